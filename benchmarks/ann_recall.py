@@ -0,0 +1,207 @@
+"""
+Recall@k vs. latency and memory report of the index types and compression options against the exact flat baseline.
+
+Run from the repository root, either on synthetic vectors or on the vectors of a saved flat index:
+
+    python -m benchmarks.ann_recall --vectors 200000 --dim 768
+    python -m benchmarks.ann_recall --index my_index --output ann_recall.json
+    python -m benchmarks.ann_recall --sweep compression
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+import faiss
+from src.ann_index import IndexConfig
+from src.index_store import is_index_directory
+
+# Index configurations compared against the flat baseline, as (label, IndexConfig keyword arguments)
+DEFAULT_SWEEP = [
+    ("ivf_flat nprobe=1", {"index_type": "ivf_flat", "nprobe": 1}),
+    ("ivf_flat nprobe=8", {"index_type": "ivf_flat", "nprobe": 8}),
+    ("ivf_flat nprobe=32", {"index_type": "ivf_flat", "nprobe": 32}),
+    ("ivf_pq nprobe=8", {"index_type": "ivf_pq", "nprobe": 8}),
+    ("ivf_pq nprobe=32", {"index_type": "ivf_pq", "nprobe": 32}),
+    ("hnsw efSearch=16", {"index_type": "hnsw", "ef_search": 16}),
+    ("hnsw efSearch=64", {"index_type": "hnsw", "ef_search": 64}),
+    ("hnsw efSearch=256", {"index_type": "hnsw", "ef_search": 256}),
+]
+
+
+def compression_sweep(d):
+    """
+    Returns the compression options compared against the flat baseline for vectors of dimension d.
+
+    :param d: The dimension of the vectors
+    :return: A list of (label, IndexConfig keyword arguments) tuples
+    """
+    return [
+        ("flat fp16", {"index_type": "flat", "compression": "fp16"}),
+        ("flat sq8", {"index_type": "flat", "compression": "sq8"}),
+        (f"pca{d // 2}", {"index_type": "flat", "reduction": "pca", "reduced_dim": d // 2}),
+        (f"pca{d // 4}", {"index_type": "flat", "reduction": "pca", "reduced_dim": d // 4}),
+        (f"pca{d // 4} sq8", {"index_type": "flat", "reduction": "pca", "reduced_dim": d // 4, "compression": "sq8"}),
+        (f"opq{d // 4} sq8", {"index_type": "flat", "reduction": "opq", "reduced_dim": d // 4, "compression": "sq8"}),
+        ("ivf_flat sq8 nprobe=16", {"index_type": "ivf_flat", "compression": "sq8", "nprobe": 16}),
+        (f"opq{d // 4} ivf_pq nprobe=16", {"index_type": "ivf_pq", "reduction": "opq", "reduced_dim": d // 4,
+                                          "nprobe": 16}),
+    ]
+
+
+def load_vectors(index_name):
+    """
+    Reads back the vectors stored in a saved flat index.
+
+    :param index_name: The name of the saved index
+    :return: A float32 matrix of the stored vectors
+    """
+    if is_index_directory(index_name):
+        index = faiss.read_index(os.path.join(index_name, "index.faiss"))
+    else:  # Saved as loose files by an earlier version
+        index = faiss.read_index(f"{index_name}.index")
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if not isinstance(base, faiss.IndexFlat):  # The ID map keeps owning base, so index must stay referenced
+        raise ValueError(f"Index '{index_name}' is not a flat index, its vectors cannot be read back exactly.")
+    return base.reconstruct_n(0, base.ntotal)
+
+
+def synthetic_vectors(n_vectors, d, n_clusters=100, seed=0):
+    """
+    Generates clustered random vectors, which behave more like sentence embeddings than uniform noise.
+
+    :param n_vectors: The number of vectors to generate
+    :param d: The dimension of the vectors
+    :param n_clusters: The number of clusters the vectors are drawn around (default: 100)
+    :param seed: The random seed (default: 0)
+    :return: A float32 matrix of shape (n_vectors, d)
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, d)).astype('float32')
+    labels = rng.integers(0, n_clusters, n_vectors)
+    return centers[labels] + 0.5 * rng.standard_normal((n_vectors, d)).astype('float32')
+
+
+def sample_queries(vectors, n_queries, seed=1):
+    """
+    Samples query vectors by perturbing random stored vectors.
+
+    :param vectors: The float32 matrix of stored vectors
+    :param n_queries: The number of queries to sample
+    :param seed: The random seed (default: 1)
+    :return: A float32 matrix of shape (n_queries, d)
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    noise = 0.1 * vectors.std() * rng.standard_normal((len(rows), vectors.shape[1]))
+    return (vectors[rows] + noise).astype('float32')
+
+
+def recall_at_k(ground_truth, found):
+    """
+    Returns the fraction of the true k nearest neighbours that were found.
+
+    :param ground_truth: The (n_queries, k) matrix of exact neighbour IDs
+    :param found: The (n_queries, k) matrix of neighbour IDs returned by the approximate index
+    :return: The mean recall@k over all queries
+    """
+    hits = sum(len(set(truth) & set(result)) for truth, result in zip(ground_truth, found))
+    return hits / ground_truth.size
+
+
+def time_queries(index, queries, k, params=None):
+    """
+    Runs the queries one at a time, as search_index does, and measures their latency.
+
+    :param index: The FAISS index to search
+    :param queries: The float32 matrix of query vectors
+    :param k: The number of neighbours per query
+    :param params: Optional faiss.SearchParameters passed to every search
+    :return: A tuple of the (n_queries, k) ID matrix and the per-query latencies in milliseconds
+    """
+    ids = np.empty((len(queries), k), dtype='int64')
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, I = index.search(query[None, :], k, params=params)
+        latencies[i] = (time.perf_counter() - start) * 1000
+        ids[i] = I[0]
+    return ids, latencies
+
+
+def run_report(vectors, queries, k=10, sweep=DEFAULT_SWEEP):
+    """
+    Builds every configuration of the sweep and compares it with the exact flat baseline.
+
+    :param vectors: The float32 matrix of vectors to index
+    :param queries: The float32 matrix of query vectors
+    :param k: The number of neighbours per query (default: 10)
+    :param sweep: A list of (label, IndexConfig keyword arguments) tuples (default: DEFAULT_SWEEP)
+    :return: A list of result dictionaries, the flat baseline first
+    """
+    ids = np.arange(len(vectors), dtype='int64')
+    built = {}  # Configurations that differ only in query-time knobs share one built index
+    results = []
+    for label, kwargs in [("flat", {"index_type": "flat"})] + list(sweep):
+        config = IndexConfig(**kwargs)
+        factory = config.factory_string(vectors.shape[1], len(vectors))
+        if (factory, config.ef_construction) not in built:
+            start = time.perf_counter()
+            index = config.create_index(vectors)
+            index.add_with_ids(vectors, ids)
+            build_time = time.perf_counter() - start
+            index_bytes = len(faiss.serialize_index(index))
+            built[factory, config.ef_construction] = index, build_time, index_bytes
+        index, build_time, index_bytes = built[factory, config.ef_construction]
+        found, latencies = time_queries(index, queries, k, config.search_parameters(index))
+        if label == "flat":
+            ground_truth = found
+        results.append({
+            "config": label,
+            "factory": factory,
+            f"recall@{k}": round(recall_at_k(ground_truth, found), 4),
+            "bytes/vector": round(index_bytes / len(vectors), 1),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            "build_s": round(build_time, 2),
+        })
+    return results
+
+
+def print_report(results):
+    """
+    Prints the results of run_report as a table.
+
+    :param results: The list returned by run_report
+    """
+    columns = list(results[0].keys())
+    widths = [max(len(column), *(len(str(row[column])) for row in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in results:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--index", help="Name of a saved flat index to take the vectors from")
+    parser.add_argument("--vectors", type=int, default=100000, help="Number of synthetic vectors (default: 100000)")
+    parser.add_argument("--dim", type=int, default=768, help="Dimension of synthetic vectors (default: 768)")
+    parser.add_argument("--queries", type=int, default=500, help="Number of queries (default: 500)")
+    parser.add_argument("-k", type=int, default=10, help="Number of neighbours per query (default: 10)")
+    parser.add_argument("--sweep", choices=["ann", "compression"], default="ann",
+                        help="Compare the ANN index types or the compression options (default: ann)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    vectors = load_vectors(args.index) if args.index else synthetic_vectors(args.vectors, args.dim)
+    queries = sample_queries(vectors, args.queries)
+    sweep = compression_sweep(vectors.shape[1]) if args.sweep == "compression" else DEFAULT_SWEEP
+    results = run_report(vectors, queries, k=args.k, sweep=sweep)
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Benchmarks of the parse, embed, build, save/load and search hot paths at several corpus sizes.
+
+Every corpus size runs in a fresh process on synthetic PDFs, so peak RSS is measured per size.
+The stub encoder is used by default, so no network access or model download is needed.
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --sizes 1000,10000,100000 --output bench.json
+    python -m benchmarks.run_benchmarks --encoder onnx --index-type ivf_flat
+    python -m benchmarks.run_benchmarks --output new.json --compare bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from benchmarks.synthetic import StubEncoder, synthetic_sentences, write_corpus
+from src.ann_index import IndexConfig
+from src.chunking import Chunker, STRATEGIES
+from src.encoder import get_encoder
+from src.indexer import FaissIndexer
+from src.parse_document import LocalFile, PdfParser
+from src.pipeline import IngestPipeline
+from src.result_cache import ResultCache
+
+# Metrics compared by --compare, and whether a higher value is better
+COMPARED_METRICS = {
+    "parse_pages_per_s": True,
+    "embed_paragraphs_per_s": True,
+    "build_s": False,
+    "save_s": False,
+    "load_s": False,
+    "load_mmap_s": False,
+    "search_qps": True,
+    "search_p50_ms": False,
+    "search_p99_ms": False,
+    "batch_search_qps": True,
+    "cached_search_qps": True,
+    "peak_rss_mb": False,
+}
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of the current process in megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def run_size(n_paragraphs, encoder="stub", index_type="flat", chunking="sections", n_queries=200, parse_workers=1,
+             seed=0):
+    """
+    Runs all benchmarks on one synthetic corpus.
+
+    :param n_paragraphs: The number of sentences in the corpus
+    :param encoder: "stub" for the hashing StubEncoder, or the SentenceEncoder backend of the real model
+                    ("torch", "quantized" or "onnx") (default: "stub")
+    :param index_type: The IndexConfig index type to build (default: "flat")
+    :param chunking: The Chunker strategy splitting documents into indexed paragraphs (default: "sections")
+    :param n_queries: The number of search queries (default: 200)
+    :param parse_workers: The number of processes parsing PDFs (default: 1)
+    :param seed: The random seed (default: 0)
+    :return: A dictionary of results
+    """
+    model = StubEncoder() if encoder == "stub" else get_encoder(backend=encoder)
+    results = {"paragraphs": n_paragraphs, "encoder": encoder, "index_type": index_type, "chunking": chunking}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths, pages = write_corpus(tmp_dir, n_paragraphs, seed=seed)
+        files = [LocalFile(path) for path in paths]
+        results["documents"] = len(files)
+        results["pages"] = pages
+
+        start = time.perf_counter()
+        parsers = PdfParser.parse_pdfs(files, max_workers=parse_workers)
+        results["parse_pages_per_s"] = pages / (time.perf_counter() - start)
+        del parsers
+
+        indexer = FaissIndexer(index_config=IndexConfig(index_type), model=model,
+                               chunker=Chunker.for_encoder(model, chunking))
+        texts = synthetic_sentences(min(n_paragraphs, 5000), seed=seed + 1)
+        start = time.perf_counter()
+        indexer.model.encode(texts)
+        results["embed_paragraphs_per_s"] = len(texts) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        results["indexed_paragraphs"] = IngestPipeline(indexer, max_workers=parse_workers).run(
+            files, expected_size=n_paragraphs)
+        results["build_s"] = time.perf_counter() - start
+
+        index_name = os.path.join(tmp_dir, "benchmark")
+        start = time.perf_counter()
+        indexer.save_index(index_name)
+        results["save_s"] = time.perf_counter() - start
+        results["index_mb"] = os.path.getsize(os.path.join(index_name, "index.faiss")) / 1e6
+        del indexer
+
+        start = time.perf_counter()
+        indexer = FaissIndexer.load_index(index_name, model=model)
+        results["load_s"] = time.perf_counter() - start
+        start = time.perf_counter()
+        FaissIndexer.load_index(index_name, model=model, mmap=True)
+        results["load_mmap_s"] = time.perf_counter() - start
+
+        queries = synthetic_sentences(n_queries, seed=seed + 2, min_words=4, max_words=10)
+        latencies = []
+        start = time.perf_counter()
+        for query_text in queries:
+            query_start = time.perf_counter()
+            indexer.search_index(query_text)
+            latencies.append((time.perf_counter() - query_start) * 1000)
+        results["search_qps"] = n_queries / (time.perf_counter() - start)
+        results["search_p50_ms"] = float(np.percentile(latencies, 50))
+        results["search_p99_ms"] = float(np.percentile(latencies, 99))
+        start = time.perf_counter()
+        indexer.search_batch(queries)
+        results["batch_search_qps"] = n_queries / (time.perf_counter() - start)
+
+        indexer.result_cache = ResultCache(max_entries=n_queries)
+        for query_text in queries:  # Fill the cache, then repeat the queries
+            indexer.search_index(query_text)
+        start = time.perf_counter()
+        for query_text in queries:
+            indexer.search_index(query_text)
+        results["cached_search_qps"] = n_queries / (time.perf_counter() - start)
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return {key: round(value, 4) if isinstance(value, float) else value for key, value in results.items()}
+
+
+def run_isolated(n_paragraphs, **kwargs):
+    """
+    Runs run_size in a fresh process, so its peak RSS does not include earlier corpus sizes.
+
+    :param n_paragraphs: The number of paragraphs in the corpus
+    :return: The dictionary of results of run_size
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_size, n_paragraphs, **kwargs).result()
+
+
+def compare(results, baseline):
+    """
+    Prints the change of every metric relative to a baseline run, for the corpus sizes both runs have.
+
+    :param results: The list of results of this run
+    :param baseline: The list of results of the baseline run
+    """
+    baseline_by_size = {row["paragraphs"]: row for row in baseline}
+    for row in results:
+        old = baseline_by_size.get(row["paragraphs"])
+        if old is None:
+            continue
+        print(f"\n{row['paragraphs']} paragraphs vs. baseline:")
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if not old.get(metric) or metric not in row:
+                continue
+            change = (row[metric] - old[metric]) / old[metric] * 100
+            better = (change > 0) == higher_is_better
+            print(f"  {metric:<24} {old[metric]:>12} -> {row[metric]:>12}  {change:+7.1f}% "
+                  f"{'better' if better else 'worse'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000", help="Comma separated corpus sizes (default: 1000,10000)")
+    parser.add_argument("--encoder", choices=["stub", "torch", "quantized", "onnx"], default="stub",
+                        help="Stub encoder or backend of the real model (default: stub)")
+    parser.add_argument("--index-type", default="flat", help="IndexConfig index type (default: flat)")
+    parser.add_argument("--chunking", choices=STRATEGIES, default="sections",
+                        help="Chunker strategy (default: sections)")
+    parser.add_argument("--queries", type=int, default=200, help="Number of search queries (default: 200)")
+    parser.add_argument("--parse-workers", type=int, default=1, help="PDF parsing processes (default: 1)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Compare with the JSON results of an earlier run")
+    args = parser.parse_args()
+
+    results = []
+    for size in (int(size) for size in args.sizes.split(",")):
+        row = run_isolated(size, encoder=args.encoder, index_type=args.index_type, chunking=args.chunking,
+                           n_queries=args.queries, parse_workers=args.parse_workers)
+        print(json.dumps(row))
+        results.append(row)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as infile:
+            compare(results, json.load(infile))
+
+
+if __name__ == "__main__":
+    main()
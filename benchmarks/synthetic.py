@@ -0,0 +1,108 @@
+"""
+Synthetic corpora for the benchmarks: generated PDFs, paragraphs and a stub sentence encoder,
+so benchmarks run offline and without downloading a model.
+"""
+import os
+import zlib
+import numpy as np
+import fitz
+
+WORDS = ("system", "value", "pressure", "sensor", "module", "control", "signal", "device", "output", "input",
+         "voltage", "current", "limit", "range", "error", "status", "data", "record", "update", "power",
+         "temperature", "switch", "cable", "port", "channel", "mode", "level", "check", "test", "unit")
+
+
+def synthetic_sentences(n_sentences, seed=0, min_words=8, max_words=24):
+    """
+    Generates random sentences from a small technical vocabulary, with part numbers mixed in.
+
+    :param n_sentences: The number of sentences to generate
+    :param seed: The random seed (default: 0)
+    :param min_words: The minimum number of words per sentence (default: 8)
+    :param max_words: The maximum number of words per sentence (default: 24)
+    :return: A list of sentences, each ending with a period
+    """
+    rng = np.random.default_rng(seed)
+    sentences = []
+    for _ in range(n_sentences):
+        words = list(rng.choice(WORDS, rng.integers(min_words, max_words + 1)))
+        words[rng.integers(len(words))] = f"{rng.integers(1, 99)}-{rng.integers(100, 999)}"
+        sentences.append(" ".join(words).capitalize() + ".")
+    return sentences
+
+
+def write_pdf(path, sentences, sentences_per_page=20, section_every=5):
+    """
+    Writes sentences to a PDF file, with a numbered section header at the top of some pages.
+
+    :param path: The path of the PDF file to write
+    :param sentences: List of sentences
+    :param sentences_per_page: The number of sentences per page (default: 20)
+    :param section_every: A section header is written every this many pages (default: 5)
+    :return: The number of pages written
+    """
+    pdf_document = fitz.open()
+    pages = 0
+    for start in range(0, len(sentences), sentences_per_page):
+        page = pdf_document.new_page()
+        text = " ".join(sentences[start:start + sentences_per_page])
+        if pages % section_every == 0:
+            page.insert_text((72, 60), f"{pages // section_every + 1}.1 Section {pages // section_every + 1}",
+                             fontsize=12)
+        page.insert_textbox(fitz.Rect(72, 80, page.rect.width - 72, page.rect.height - 72), text, fontsize=8)
+        pages += 1
+    pdf_document.save(path)
+    pdf_document.close()
+    return pages
+
+
+def write_corpus(directory, n_sentences, sentences_per_document=1000, seed=0):
+    """
+    Writes a synthetic corpus of PDF files.
+
+    :param directory: The directory to write the PDF files to
+    :param n_sentences: The total number of sentences in the corpus
+    :param sentences_per_document: The number of sentences per PDF file (default: 1000)
+    :param seed: The random seed (default: 0)
+    :return: A tuple of the list of PDF paths and the total number of pages
+    """
+    sentences = synthetic_sentences(n_sentences, seed=seed)
+    paths = []
+    pages = 0
+    for number, start in enumerate(range(0, n_sentences, sentences_per_document)):
+        path = os.path.join(directory, f"document_{number:04d}.pdf")
+        pages += write_pdf(path, sentences[start:start + sentences_per_document])
+        paths.append(path)
+    return paths, pages
+
+
+class StubEncoder:
+    """
+    A class to stand in for SentenceTransformer in benchmarks: it hashes words into a fixed-size
+    bag-of-words vector, which is deterministic, fast, and keeps lexically similar texts close.
+    """
+
+    def __init__(self, dimension=768):
+        """
+        Initialize StubEncoder class.
+
+        :param dimension: The dimension of the embeddings (default: 768, like distilroberta)
+        """
+        self.dimension = dimension
+
+    def encode(self, texts, **kwargs):
+        """
+        Encodes texts into L2-normalized hashed bag-of-words vectors.
+
+        :param texts: List of texts to encode
+        :return: A float32 matrix with one embedding per text
+        """
+        embeddings = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                embeddings[row, zlib.crc32(word.encode("utf-8")) % self.dimension] += 1.0
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
@@ -6,6 +6,7 @@ from pathlib import Path
 import faiss
 from src.parse_document import PdfParser
 from src.indexer import FaissIndexer
+from src.index_store import IndexLoadError
 
 
 """
@@ -62,7 +63,10 @@ if st.button("Build Index"):
 query = st.text_input("Enter a search query:")
 if st.button("Search"):
     # Search the index using the query
-    indexer = FaissIndexer.load_index('./tmp.index')  # Load the index and assign it to the indexer variable
+    try:
+        indexer = FaissIndexer.load_index('./tmp.index')  # Load the index and assign it to the indexer variable
+    except IndexLoadError:
+        indexer = None
 
     if indexer:  # Check if index was successfully loaded
         st.markdown('**:blue[Loaded index from: tmp.index]**')
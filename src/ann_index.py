@@ -0,0 +1,341 @@
+import math
+import numpy as np
+import faiss
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "auto")
+COMPRESSIONS = (None, "fp16", "sq8")
+REDUCTIONS = (None, "pca", "opq")
+RERANKERS = (None, "exact", "cross-encoder")
+
+
+class IndexConfig:
+    """
+    A class to describe which kind of FAISS index to build and how to search it.
+
+    Supported index types are exact search ("flat"), inverted file lists with full vectors ("ivf_flat")
+    or product-quantized codes ("ivf_pq"), graph based search ("hnsw"), and "auto", which picks one
+    of them by corpus size.
+
+    Vectors can be stored as float16 ("fp16") or 8-bit scalar quantized ("sq8") codes, and reduced to
+    fewer dimensions by a PCA or OPQ transform. The transform is part of the FAISS index, so it is saved
+    and loaded with it.
+
+    Searches can re-rank rerank_candidates times more results than asked for, to recover the quality lost
+    by approximate search or compression: "exact" rescores them with the full-precision vectors, which are
+    stored next to the index, "cross-encoder" with a cross-encoder model scoring query and paragraph together.
+    """
+
+    # Corpus sizes at which "auto" switches from exact search to IVF-Flat, and from IVF-Flat to IVF-PQ
+    AUTO_IVF_THRESHOLD = 20000
+    AUTO_PQ_THRESHOLD = 2000000
+    # Number of streamed vectors buffered to train an IVF index when the corpus size is unknown
+    STREAM_TRAIN_SIZE = 65536
+    # Number of vectors sampled to train scalar quantizers and PCA/OPQ transforms of non-IVF indexes
+    TRANSFORM_TRAIN_SIZE = 20000
+
+    def __init__(self, index_type="flat", nlist=None, pq_m=None, pq_nbits=8, hnsw_m=32, ef_construction=40,
+                 nprobe=8, ef_search=64, train_size=None, seed=1234, compression=None, reduction=None,
+                 reduced_dim=None, rerank=None, rerank_candidates=4, rerank_budget_ms=None, rerank_model=None):
+        """
+        Initialize IndexConfig class with the index type and its tuning knobs.
+
+        :param index_type: One of "flat", "ivf_flat", "ivf_pq", "hnsw" or "auto" (default: "flat")
+        :param nlist: Number of IVF cells (default: 4 * sqrt(number of vectors))
+        :param pq_m: Number of PQ sub-quantizers, must divide the dimension (default: picked from the dimension)
+        :param pq_nbits: Bits per PQ sub-quantizer code (default: 8)
+        :param hnsw_m: Number of neighbours per HNSW node (default: 32)
+        :param ef_construction: HNSW candidate list size while adding vectors (default: 40)
+        :param nprobe: Number of IVF cells visited per query (default: 8)
+        :param ef_search: HNSW candidate list size per query (default: 64)
+        :param train_size: Number of vectors sampled to train IVF indexes (default: 64 per IVF cell)
+        :param seed: Seed of the training sample (default: 1234)
+        :param compression: None for float32 vectors, "fp16" or "sq8"; ignored by "ivf_pq" indexes (default: None)
+        :param reduction: None, "pca" or "opq" to reduce the dimension of the vectors (default: None)
+        :param reduced_dim: The dimension vectors are reduced to (default: a quarter of the dimension)
+        :param rerank: None, "exact" or "cross-encoder" to re-rank the results of a search (default: None)
+        :param rerank_candidates: The number of candidates re-ranked per result asked for (default: 4)
+        :param rerank_budget_ms: Optional time budget of a search in milliseconds; queries not re-ranked
+                                 by then keep the order of the first stage (default: no budget)
+        :param rerank_model: The name of the cross-encoder model (default: see reranking.get_cross_encoder)
+        """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {', '.join(INDEX_TYPES)}.")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compression}', expected one of fp16, sq8.")
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"Unknown reduction '{reduction}', expected one of pca, opq.")
+        if rerank not in RERANKERS:
+            raise ValueError(f"Unknown reranker '{rerank}', expected one of exact, cross-encoder.")
+        if rerank_candidates < 1:
+            raise ValueError("rerank_candidates must be at least 1.")
+        self.index_type = index_type
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.train_size = train_size
+        self.seed = seed
+        self.compression = compression
+        self.reduction = reduction
+        self.reduced_dim = reduced_dim
+        self.rerank = rerank
+        self.rerank_candidates = rerank_candidates
+        self.rerank_budget_ms = rerank_budget_ms
+        self.rerank_model = rerank_model
+
+    def resolve_type(self, n_vectors):
+        """
+        Returns the concrete index type to build for a corpus of the given size.
+        "auto" never picks HNSW, because HNSW indexes do not support removing documents.
+
+        :param n_vectors: The number of vectors the index is built from
+        :return: One of "flat", "ivf_flat", "ivf_pq" or "hnsw"
+        """
+        if self.index_type != "auto":
+            return self.index_type
+        if n_vectors < self.AUTO_IVF_THRESHOLD:
+            return "flat"
+        if n_vectors < self.AUTO_PQ_THRESHOLD:
+            return "ivf_flat"
+        return "ivf_pq"
+
+    def resolve_nlist(self, n_vectors):
+        """
+        Returns the number of IVF cells for a corpus of the given size.
+
+        :param n_vectors: The number of vectors the index is built from
+        :return: The number of IVF cells
+        """
+        if self.nlist:
+            return self.nlist
+        return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39 or 1))
+
+    def resolve_pq_m(self, d):
+        """
+        Returns the number of PQ sub-quantizers for vectors of dimension d.
+
+        :param d: The dimension of the vectors
+        :return: The number of sub-quantizers, a divisor of d
+        """
+        if self.pq_m:
+            return self.pq_m
+        return max(m for m in range(1, max(1, d // 8) + 1) if d % m == 0)
+
+    def resolve_reduction(self, n_train=None):
+        """
+        Returns the transform to reduce the vectors with. OPQ trains 8-bit codebooks, so indexes trained
+        on fewer than 256 vectors are reduced with PCA instead.
+
+        :param n_train: The number of vectors the index is trained on, if known
+        :return: None, "pca" or "opq"
+        """
+        if self.reduction == "opq" and n_train is not None and n_train < 2 ** 8:
+            return "pca"
+        return self.reduction
+
+    def resolve_reduced_dim(self, d, n_train=None):
+        """
+        Returns the dimension of the vectors once reduced. PCA cannot output more dimensions than
+        it has training vectors, so the dimension is capped by the training size.
+
+        :param d: The dimension of the vectors
+        :param n_train: The number of vectors the index is trained on, if known
+        :return: The reduced dimension, or d if there is no reduction
+        """
+        reduction = self.resolve_reduction(n_train)
+        if reduction is None:
+            return d
+        reduced_dim = self.reduced_dim or max(1, d // 4)
+        if reduction == "pca" and n_train is not None:
+            reduced_dim = min(reduced_dim, n_train)
+        if reduction == "opq":
+            reduced_dim -= reduced_dim % self.resolve_pq_m(reduced_dim)  # OPQ output must be split evenly
+        return reduced_dim
+
+    def factory_string(self, d, n_vectors, n_train=None):
+        """
+        Returns the FAISS index factory string of the index to build.
+        IVF-PQ indexes of corpora too small to train their codebooks on are built as IVF-Flat indexes,
+        IVF indexes get at most one cell per training vector, and transforms are reduced as needed,
+        see resolve_reduced_dim.
+
+        :param d: The dimension of the vectors
+        :param n_vectors: The number of vectors the index is built from
+        :param n_train: The number of vectors the index is trained on (default: see resolve_train_size)
+        :return: A string for faiss.index_factory
+        """
+        if n_train is None:
+            n_train = min(n_vectors, self.resolve_train_size(n_vectors))
+        index_type = self.resolve_type(n_vectors)
+        if index_type == "ivf_pq" and n_train < 2 ** self.pq_nbits:
+            index_type = "ivf_flat"  # Every PQ codebook has 2 ** pq_nbits centroids to train
+        reduction = self.resolve_reduction(n_train)
+        reduced_dim = self.resolve_reduced_dim(d, n_train)
+        transform = ""
+        if reduction == "pca":
+            transform = f"PCA{reduced_dim},"
+        elif reduction == "opq":
+            transform = f"OPQ{self.resolve_pq_m(reduced_dim)}_{reduced_dim},"
+        codes = {None: "Flat", "fp16": "SQfp16", "sq8": "SQ8"}[self.compression]
+        if index_type == "flat":
+            return f"IDMap2,{transform}{codes}"
+        if index_type == "hnsw":
+            return f"IDMap2,{transform}HNSW{self.hnsw_m}" + (f"_{codes}" if self.compression else "")
+        nlist = min(self.resolve_nlist(n_vectors), n_train)  # k-means needs a training point per cell
+        if index_type == "ivf_flat":
+            return f"{transform}IVF{nlist},{codes}"
+        return f"{transform}IVF{nlist},PQ{self.resolve_pq_m(reduced_dim)}x{self.pq_nbits}"
+
+    def needs_training(self, n_vectors=None):
+        """
+        Returns whether the index built for a corpus of the given size has to be trained.
+
+        :param n_vectors: The expected number of vectors in the index, if known
+        :return: True for IVF indexes, scalar quantizers and PCA/OPQ transforms
+        """
+        if self.compression == "sq8" or self.reduction is not None:
+            return True
+        if n_vectors is None:
+            return self.index_type in ("ivf_flat", "ivf_pq", "auto")
+        return self.resolve_type(n_vectors) in ("ivf_flat", "ivf_pq")
+
+    def resolve_train_size(self, n_vectors):
+        """
+        Returns the number of vectors to train the index on.
+
+        :param n_vectors: The number of vectors the index is built from
+        :return: The size of the training sample
+        """
+        if self.train_size:
+            return self.train_size
+        if self.resolve_type(n_vectors) in ("ivf_flat", "ivf_pq"):
+            return max(64 * self.resolve_nlist(n_vectors), self.TRANSFORM_TRAIN_SIZE if self.reduction else 0)
+        return self.TRANSFORM_TRAIN_SIZE
+
+    def required_training_size(self, n_vectors=None):
+        """
+        Returns how many vectors to collect before the index can be created, when vectors arrive in batches.
+
+        :param n_vectors: The expected number of vectors in the index, if known
+        :return: The number of vectors, 0 if the index needs no training
+        """
+        if not self.needs_training(n_vectors):
+            return 0
+        if n_vectors is None:
+            return self.train_size or self.STREAM_TRAIN_SIZE
+        return min(n_vectors, self.resolve_train_size(n_vectors))
+
+    def create_index(self, embeddings, n_vectors=None):
+        """
+        Creates an empty ID-mapped FAISS index for the given embeddings and trains it if needed.
+
+        :param embeddings: A float32 matrix of the vectors to be added first, used as the training set
+        :param n_vectors: The expected number of vectors in the index (default: the number of embeddings)
+        :return: The trained, empty FAISS index
+        """
+        d = embeddings.shape[1]
+        n_vectors = max(n_vectors or 0, len(embeddings))
+        sample = self.training_sample(embeddings, n_vectors)
+        index = faiss.index_factory(d, self.factory_string(d, n_vectors, len(sample)))
+        hnsw = _base_index(index)
+        if isinstance(hnsw, faiss.IndexHNSW):
+            hnsw.hnsw.efConstruction = self.ef_construction
+        if not index.is_trained:
+            index.train(sample)
+        return index
+
+    def training_sample(self, embeddings, n_vectors):
+        """
+        Returns a random sample of the embeddings to train an index on.
+
+        :param embeddings: A float32 matrix of vectors
+        :param n_vectors: The number of vectors the index is built from
+        :return: A float32 matrix with at most train_size rows
+        """
+        train_size = self.resolve_train_size(n_vectors)
+        if len(embeddings) <= train_size:
+            return embeddings
+        rng = np.random.default_rng(self.seed)
+        return embeddings[np.sort(rng.choice(len(embeddings), train_size, replace=False))]
+
+    def search_parameters(self, index, selector=None):
+        """
+        Returns the query-time parameters (nprobe / efSearch, and an optional ID filter) for searching the given index.
+
+        :param index: A FAISS index created by create_index
+        :param selector: Optional faiss.IDSelector restricting the search to some vector IDs
+        :return: A faiss.SearchParameters object, or None for exact indexes searched without a selector
+        """
+        base = _base_index(index)
+        if isinstance(base, faiss.IndexIVF):
+            params = faiss.SearchParametersIVF(nprobe=self.nprobe)
+        elif isinstance(base, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(efSearch=self.ef_search)
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+        params.referenced_objects = [selector]  # The parameters do not own their selector
+        if selector is not None and isinstance(index, faiss.IndexIDMap) and _has_transform(index):
+            # IndexIDMap translates the selector of the outer parameters only, not one passed on past a transform
+            selector = faiss.IDSelectorTranslated(index.id_map, selector)
+            params.referenced_objects.append(selector)
+        params.sel = selector
+        if _has_transform(index):
+            params = faiss.SearchParametersPreTransform(index_params=params)
+        return params
+
+    def to_dict(self):
+        """
+        Returns the configuration as a JSON serializable dictionary.
+        """
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a configuration from a dictionary returned by to_dict.
+
+        :param data: The dictionary to read the configuration from
+        :return: An instance of IndexConfig
+        """
+        return cls(**data)
+
+
+def supports_removal(index):
+    """
+    Returns whether vectors can be removed from a FAISS index; HNSW graphs do not support it.
+
+    :param index: A FAISS index created by IndexConfig.create_index
+    :return: True if remove_ids can be called on the index
+    """
+    return not isinstance(_base_index(index), faiss.IndexHNSW)
+
+
+def _base_index(index):
+    """
+    Returns the innermost index of an ID-mapped or transformed index.
+
+    :param index: A FAISS index
+    :return: The downcast wrapped index, or the index itself if it is not wrapped
+    """
+    while isinstance(index, (faiss.IndexIDMap, faiss.IndexPreTransform)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def _has_transform(index):
+    """
+    Returns whether a PCA/OPQ transform is applied to vectors before they reach the innermost index.
+
+    :param index: A FAISS index
+    :return: True if the index wraps an IndexPreTransform
+    """
+    while isinstance(index, (faiss.IndexIDMap, faiss.IndexPreTransform)):
+        if isinstance(index, faiss.IndexPreTransform):
+            return True
+        index = faiss.downcast_index(index.index)
+    return False
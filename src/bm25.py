@@ -0,0 +1,214 @@
+import json
+import re
+from collections import Counter
+import numpy as np
+
+# Words, with identifiers such as part numbers "12-345", section numbers "2.1.3" and paths "a/b" kept whole
+TOKEN = re.compile(r'\w+(?:[.\-/]\w+)*')
+TOKEN_SEPARATOR = re.compile(r'[.\-/]')
+
+
+def tokenize(text, parts=True):
+    """
+    Splits a text into lowercase terms. Compound identifiers such as "12-345" or "2.1.3" are kept
+    as one term, so they are matched exactly, and their parts are added as terms too.
+
+    :param text: The text to tokenize
+    :param parts: Whether to add the parts of compound identifiers; queries are not expanded, so "2.1"
+                  does not match paragraphs on a bare "2" or "1" (default: True)
+    :return: A list of terms
+    """
+    terms = []
+    for token in TOKEN.findall(text.lower()):
+        terms.append(token)
+        if parts and TOKEN_SEPARATOR.search(token):
+            terms.extend(TOKEN_SEPARATOR.split(token))
+    return terms
+
+
+def reciprocal_rank_fusion(results, k=5, rrf_k=60):
+    """
+    Fuses the ranked results of several retrievers by reciprocal rank fusion: every paragraph scores
+    the sum of 1 / (rrf_k + rank) over the rankings it appears in.
+
+    :param results: List of (scores or distances, IDs, paragraphs) tuples as returned by search_batch,
+                    one per retriever, each ranked best first
+    :param k: The number of fused results to return per query (default: 5)
+    :param rrf_k: The rank offset, which dampens the weight of the top ranks (default: 60)
+    :return: A tuple containing the fused score and ID matrices, one row per query, and a list with
+             the matching paragraphs of each query
+    """
+    n_queries = len(results[0][1])
+    fused_scores = np.zeros((n_queries, k), dtype='float32')
+    fused_ids = np.full((n_queries, k), -1, dtype='int64')
+    search_results = []
+    for row in range(n_queries):
+        scores = {}
+        paragraphs = {}
+        for _, I, texts in results:
+            for rank, (i, text) in enumerate(zip(I[row].tolist(), texts[row])):
+                scores[i] = scores.get(i, 0.0) + 1.0 / (rrf_k + rank + 1)
+                paragraphs[i] = text
+        best = sorted(scores, key=scores.get, reverse=True)[:k]
+        fused_scores[row, :len(best)] = [scores[i] for i in best]
+        fused_ids[row, :len(best)] = best
+        search_results.append([paragraphs[i] for i in best])
+    return fused_scores, fused_ids, search_results
+
+
+class BM25Index:
+    """
+    A class for an inverted index ranking paragraphs by Okapi BM25, with paragraphs identified by their vector IDs.
+
+    Posting lists are stored in compressed sparse row form: the vector IDs and term frequencies of all
+    terms in two flat numpy arrays, sorted by term, and the offset of every term's list in a third one.
+    Added paragraphs are buffered and merged into the arrays on the next search or save.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        """
+        Initialize BM25Index class with no paragraphs.
+
+        :param k1: The term frequency saturation (default: 1.2)
+        :param b: The paragraph length normalization (default: 0.75)
+        """
+        self.k1 = k1
+        self.b = b
+        self.terms = {}  # Maps every term to its term ID
+        self.indptr = np.zeros(1, dtype='int64')  # Posting list of term t at postings[indptr[t]:indptr[t + 1]]
+        self.postings = np.empty(0, dtype='int32')
+        self.frequencies = np.empty(0, dtype='uint16')
+        self.lengths = np.empty(0, dtype='int32')  # Number of terms of every paragraph, -1 if removed
+        self._pending = []  # (term IDs, vector IDs, frequencies) of added paragraphs not merged yet
+        self._pending_lengths = []
+        self._dirty = False  # Whether paragraphs were added or removed since the last merge
+
+    def __len__(self):
+        return len(self.lengths) + sum(len(lengths) for lengths in self._pending_lengths)
+
+    def add(self, paragraphs):
+        """
+        Adds the next paragraphs, which get the next vector IDs.
+
+        :param paragraphs: List of paragraph texts; None adds a removed paragraph
+        """
+        term_ids, ids, frequencies, lengths = [], [], [], []
+        for i, paragraph in enumerate(paragraphs, start=len(self)):
+            if paragraph is None:
+                lengths.append(-1)
+                continue
+            terms = tokenize(paragraph)
+            lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                term_ids.append(self.terms.setdefault(term, len(self.terms)))
+                ids.append(i)
+                frequencies.append(min(frequency, 65535))
+        self._pending.append((np.array(term_ids, dtype='int64'), np.array(ids, dtype='int32'),
+                              np.array(frequencies, dtype='uint16')))
+        self._pending_lengths.append(np.array(lengths, dtype='int32'))
+        self._dirty = True
+
+    def remove(self, ids):
+        """
+        Removes paragraphs; their postings are dropped on the next merge.
+
+        :param ids: The vector IDs of the paragraphs
+        """
+        self._merge()
+        self.lengths[np.asarray(ids, dtype='int64')] = -1
+        self._dirty = True
+
+    def _merge(self):
+        """
+        Merges the added paragraphs into the posting lists and drops the postings of removed paragraphs.
+        """
+        if not self._dirty:
+            return
+        term_ids = [np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))]
+        ids = [self.postings]
+        frequencies = [self.frequencies]
+        for pending_terms, pending_ids, pending_frequencies in self._pending:
+            term_ids.append(pending_terms)
+            ids.append(pending_ids)
+            frequencies.append(pending_frequencies)
+        self.lengths = np.concatenate([self.lengths] + self._pending_lengths)
+        term_ids, ids, frequencies = np.concatenate(term_ids), np.concatenate(ids), np.concatenate(frequencies)
+        keep = self.lengths[ids] >= 0
+        term_ids, ids, frequencies = term_ids[keep], ids[keep], frequencies[keep]
+        order = np.lexsort((ids, term_ids))
+        self.postings = ids[order]
+        self.frequencies = frequencies[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(self.terms)))])
+        self._pending = []
+        self._pending_lengths = []
+        self._dirty = False
+
+    def search(self, queries, k=5, mask=None):
+        """
+        Ranks the paragraphs containing query terms by their BM25 score.
+
+        :param queries: List of query texts
+        :param k: The number of top results to return per query (default: 5)
+        :param mask: Optional boolean array by vector ID, restricting the search to the True entries
+        :return: A tuple containing the score and ID matrices, one row per query, best first,
+                 with -1 IDs after the last matching paragraph
+        """
+        self._merge()
+        live = self.lengths >= 0
+        n_paragraphs = int(live.sum())
+        average_length = self.lengths[live].mean() if n_paragraphs else 1.0
+        scores = np.zeros((len(queries), k), dtype='float32')
+        result_ids = np.full((len(queries), k), -1, dtype='int64')
+        for row, query_text in enumerate(queries):
+            term_ids = {self.terms[term] for term in tokenize(query_text, parts=False) if term in self.terms}
+            matches, partial_scores = [], []
+            for term_id in term_ids:
+                ids = self.postings[self.indptr[term_id]:self.indptr[term_id + 1]]
+                frequencies = self.frequencies[self.indptr[term_id]:self.indptr[term_id + 1]].astype('float32')
+                idf = np.log(1.0 + (n_paragraphs - len(ids) + 0.5) / (len(ids) + 0.5))
+                norm = self.k1 * (1.0 - self.b + self.b * self.lengths[ids] / average_length)
+                matches.append(ids)
+                partial_scores.append(idf * frequencies * (self.k1 + 1.0) / (frequencies + norm))
+            if not matches:
+                continue
+            ids = np.concatenate(matches)
+            partial_scores = np.concatenate(partial_scores)
+            if mask is not None:
+                allowed = mask[ids]
+                ids, partial_scores = ids[allowed], partial_scores[allowed]
+            ids, positions = np.unique(ids, return_inverse=True)
+            totals = np.bincount(positions, weights=partial_scores)
+            top = np.argsort(-totals, kind='stable')[:k]
+            scores[row, :len(top)] = totals[top]
+            result_ids[row, :len(top)] = ids[top]
+        return scores, result_ids
+
+    def save(self, filename):
+        """
+        Saves the index to a .npz file.
+
+        :param filename: The path of the file to write
+        """
+        self._merge()
+        terms = sorted(self.terms, key=self.terms.get)
+        with open(filename, 'wb') as outfile:
+            np.savez(outfile, terms=np.array(json.dumps(terms)), indptr=self.indptr, postings=self.postings,
+                     frequencies=self.frequencies, lengths=self.lengths, parameters=np.array([self.k1, self.b]))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Loads an index saved by save.
+
+        :param filename: The path of the .npz file
+        :return: An instance of BM25Index class
+        """
+        with np.load(filename) as data:
+            k1, b = data["parameters"].tolist()
+            index = cls(k1=k1, b=b)
+            index.terms = {term: term_id for term_id, term in enumerate(json.loads(str(data["terms"])))}
+            index.indptr = data["indptr"]
+            index.postings = data["postings"]
+            index.frequencies = data["frequencies"]
+            index.lengths = data["lengths"]
+        return index
@@ -0,0 +1,239 @@
+import re
+
+PARAGRAPH_SEPARATOR = re.compile(r'\n\n|\.\s+(?=\S)')
+SENTENCE_SEPARATOR = re.compile(r'(?<=[.!?])\s+(?=\S)')
+WORD = re.compile(r'\S+')
+
+STRATEGIES = ("sections", "sentences", "tokens", "regex")
+
+
+def _split_spans(pattern, text):
+    """
+    Splits a text at the matches of a pattern, like re.split, but returns character spans.
+
+    :param pattern: A compiled regular expression matching the separators
+    :param text: The text to split
+    :return: A list of (start, end) spans of the pieces between separators
+    """
+    spans = []
+    position = 0
+    for match in pattern.finditer(text):
+        spans.append((position, match.start()))
+        position = match.end()
+    spans.append((position, len(text)))
+    return spans
+
+
+def _byte_length(text):
+    return len(text) if text.isascii() else len(text.encode("utf-8"))
+
+
+class Chunk:
+    """
+    A class for a piece of a document that is embedded as one vector, with its source metadata.
+
+    ``start`` and ``end`` are UTF-8 byte offsets into the document's text, i.e. its paragraphs
+    joined by newlines, and ``page`` is the 1-based page the chunk starts on (None if unknown).
+    """
+
+    __slots__ = ("text", "document", "page", "header", "start", "end")
+
+    def __init__(self, text, document=None, page=None, header=None, start=None, end=None):
+        self.text = text
+        self.document = document
+        self.page = page
+        self.header = header
+        self.start = start
+        self.end = end
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"Chunk({self.text[:40]!r}, document={self.document!r}, page={self.page!r}, header={self.header!r})"
+
+
+class Chunker:
+    """
+    A class to split the paragraphs of a document into chunks sized for the embedding model.
+
+    Strategies:
+        "sections": sentences packed into chunks of at most max_tokens, never across a section header.
+        "sentences": sentences packed into chunks of at most max_tokens, regardless of headers.
+        "tokens": fixed windows of max_tokens tokens overlapping by overlap tokens, regardless of structure.
+        "regex": the former split at blank lines and sentence ends, one chunk per piece.
+
+    Tokens are counted with the model's tokenizer when one is given, otherwise whitespace-separated
+    words stand in for tokens. Sentences longer than max_tokens are cut into overlapping token windows.
+    """
+
+    def __init__(self, strategy="sections", max_tokens=126, overlap=16, tokenizer=None):
+        """
+        Initialize Chunker class.
+
+        :param strategy: One of "sections", "sentences", "tokens" or "regex" (default: "sections")
+        :param max_tokens: The largest number of tokens of a chunk (default: 126)
+        :param overlap: The number of tokens shared by consecutive token windows (default: 16)
+        :param tokenizer: Optional Hugging Face tokenizer counting tokens like the embedding model does
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown chunking strategy '{strategy}', expected one of {', '.join(STRATEGIES)}.")
+        if not 0 <= overlap < max_tokens:
+            raise ValueError("The overlap must be smaller than max_tokens.")
+        self.strategy = strategy
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.tokenizer = tokenizer
+
+    @classmethod
+    def for_encoder(cls, encoder, strategy="sections", overlap=16):
+        """
+        Creates a chunker sized for an encoder's maximum sequence length, using its tokenizer if it has one.
+
+        :param encoder: A SentenceEncoder, or any encoder with optional tokenizer and max_seq_length attributes
+        :param strategy: The chunking strategy (default: "sections")
+        :param overlap: The number of tokens shared by consecutive token windows (default: 16)
+        :return: A Chunker instance
+        """
+        tokenizer = getattr(encoder, "tokenizer", None)
+        max_seq_length = getattr(encoder, "max_seq_length", None) or 128
+        return cls(strategy, max_tokens=max_seq_length - 2, overlap=overlap, tokenizer=tokenizer)  # <s> and </s>
+
+    def token_spans(self, text):
+        """
+        Returns the character spans of the tokens of a text.
+
+        :param text: The text to tokenize
+        :return: A list of (start, end) spans
+        """
+        if self.tokenizer is None:
+            return [match.span() for match in WORD.finditer(text)]
+        encoding = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        return [tuple(span) for span in encoding["offset_mapping"] if span[1] > span[0]]
+
+    def count_tokens(self, texts):
+        """
+        Counts the tokens of several texts.
+
+        :param texts: List of texts
+        :return: A list with the number of tokens of every text
+        """
+        if not texts:
+            return []
+        if self.tokenizer is None:
+            return [len(WORD.findall(text)) for text in texts]
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+    def chunk(self, paragraphs, document=None):
+        """
+        Splits the paragraphs of a document into chunks, lazily.
+
+        :param paragraphs: Iterable of paragraph texts, or of dictionaries with "text" and optional
+                           "page" and "header" keys, such as the records of PdfParser.iter_blocks
+        :param document: The name of the document, stored in the chunks
+        :return: A generator of Chunk objects
+        """
+        paragraphs = self._locate(paragraphs)
+        if self.strategy == "regex":
+            return self._split_regex(paragraphs, document)
+        if self.strategy == "tokens":
+            return self._token_windows(paragraphs, document)
+        return self._pack_sentences(paragraphs, document)
+
+    @staticmethod
+    def _locate(paragraphs):
+        """
+        Yields paragraphs as (text, page, header, byte offset in the document text) tuples.
+        """
+        offset = 0
+        for paragraph in paragraphs:
+            if isinstance(paragraph, str):
+                text, page, header = paragraph, None, None
+            else:
+                text, page, header = paragraph["text"], paragraph.get("page"), paragraph.get("header")
+            yield text, page, header, offset
+            offset += _byte_length(text) + 1  # Paragraphs are joined by a newline in the document text
+
+    def _split_regex(self, paragraphs, document):
+        for text, page, header, offset in paragraphs:
+            for start, end in _split_spans(PARAGRAPH_SEPARATOR, text):
+                if text[start:end].strip():
+                    start_byte = offset + _byte_length(text[:start])
+                    yield Chunk(text[start:end], document, page, header,
+                                start_byte, start_byte + _byte_length(text[start:end]))
+
+    def _pack_sentences(self, paragraphs, document):
+        pending = []  # (text, page, header, start byte, end byte) of the sentences of the next chunk
+        pending_tokens = 0
+        for text, page, header, offset in paragraphs:
+            spans = [(start, end) for start, end in _split_spans(SENTENCE_SEPARATOR, text) if text[start:end].strip()]
+            sentences = [text[start:end] for start, end in spans]
+            for (start, end), sentence, n_tokens in zip(spans, sentences, self.count_tokens(sentences)):
+                start_byte = offset + _byte_length(text[:start])
+                new_section = self.strategy == "sections" and pending and pending[0][2] != header
+                if pending and (new_section or pending_tokens + n_tokens > self.max_tokens):
+                    yield self._join(pending, document)
+                    pending = []
+                    pending_tokens = 0
+                if n_tokens > self.max_tokens:
+                    yield from self._windows(sentence, self.token_spans(sentence), page, header, start_byte, document)
+                    continue
+                pending.append((sentence, page, header, start_byte, start_byte + _byte_length(sentence)))
+                pending_tokens += n_tokens
+        if pending:
+            yield self._join(pending, document)
+
+    @staticmethod
+    def _join(sentences, document):
+        _, page, header, start, _ = sentences[0]
+        return Chunk(" ".join(sentence[0] for sentence in sentences), document, page, header, start, sentences[-1][4])
+
+    def _windows(self, text, spans, page, header, offset, document):
+        """
+        Cuts a text into overlapping windows of max_tokens tokens.
+
+        :param text: The text to cut
+        :param spans: The character spans of the tokens of the text
+        :param offset: The byte offset of the text in the document text
+        :return: A generator of Chunk objects
+        """
+        step = self.max_tokens - self.overlap
+        for first in range(0, len(spans), step):
+            window = spans[first:first + self.max_tokens]
+            start, end = window[0][0], window[-1][1]
+            start_byte = offset + _byte_length(text[:start])
+            yield Chunk(text[start:end], document, page, header, start_byte, start_byte + _byte_length(text[start:end]))
+            if first + self.max_tokens >= len(spans):
+                break
+
+    def _token_windows(self, paragraphs, document):
+        buffer = ""  # The document text from the first token not yet chunked on
+        buffer_offset = 0  # The byte offset of the buffer in the document text
+        tokens = []  # (start, end, page, header) of the buffered tokens, with character spans in the buffer
+        covered = 0  # The number of buffered tokens already part of a chunk
+        step = self.max_tokens - self.overlap
+        for text, page, header, offset in paragraphs:
+            if buffer:
+                buffer += "\n"
+            else:
+                buffer_offset = offset
+            shift = len(buffer)
+            buffer += text
+            tokens.extend((shift + start, shift + end, page, header) for start, end in self.token_spans(text))
+            while len(tokens) >= self.max_tokens:
+                yield self._buffer_chunk(buffer, buffer_offset, tokens[:self.max_tokens], document)
+                tokens = tokens[step:]
+                covered = min(len(tokens), self.overlap)  # Only the overlap is part of the chunk just emitted
+                cut = tokens[0][0] if tokens else len(buffer)
+                buffer_offset += _byte_length(buffer[:cut])
+                buffer = buffer[cut:]
+                tokens = [(start - cut, end - cut, page, header) for start, end, page, header in tokens]
+        if len(tokens) > covered:
+            yield self._buffer_chunk(buffer, buffer_offset, tokens, document)
+
+    @staticmethod
+    def _buffer_chunk(buffer, buffer_offset, tokens, document):
+        start, end = tokens[0][0], tokens[-1][1]
+        start_byte = buffer_offset + _byte_length(buffer[:start])
+        return Chunk(buffer[start:end], document, tokens[0][2], tokens[0][3],
+                     start_byte, start_byte + _byte_length(buffer[start:end]))
@@ -0,0 +1,162 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.encoder import MODEL_NAME
+
+
+def model_key(model):
+    """
+    Returns the name the embeddings of an encoder are cached under: its model name and backend,
+    since backends produce slightly different vectors.
+
+    :param model: A sentence encoder, see src.encoder.get_encoder
+    :return: The model name of the cache
+    """
+    model_name = getattr(model, "model_name", MODEL_NAME)
+    backend = getattr(model, "backend", None)
+    return f"{model_name}:{backend}" if backend else model_name
+
+
+class EmbeddingCache:
+    """
+    A class to cache sentence embeddings keyed by model name and a hash of the text.
+
+    Query embeddings are kept in a bounded in-memory LRU cache, paragraph embeddings in a persistent
+    SQLite database, so re-indexing unchanged paragraphs or repeating queries skips the model.
+    """
+
+    def __init__(self, model_name, path="embedding_cache.sqlite", query_cache_size=1024):
+        """
+        Initialize EmbeddingCache class.
+
+        :param model_name: The name of the model the embeddings are computed with
+        :param path: The SQLite file storing paragraph embeddings, ":memory:" to keep them in memory only
+                     (default: "embedding_cache.sqlite")
+        :param query_cache_size: The maximum number of query embeddings kept in memory (default: 1024)
+        """
+        self.model_name = model_name
+        self.path = path
+        self.query_cache_size = query_cache_size
+        self.query_embeddings = OrderedDict()
+        self.counters = {"query_hits": 0, "query_misses": 0, "paragraph_hits": 0, "paragraph_misses": 0}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                                 "(model TEXT, hash BLOB, vector BLOB, PRIMARY KEY (model, hash))")
+        self._connection.commit()
+
+    @classmethod
+    def for_encoder(cls, model, **kwargs):
+        """
+        Creates a cache for the embeddings of an encoder.
+
+        :param model: A sentence encoder, see src.encoder.get_encoder
+        :param kwargs: The other arguments of EmbeddingCache
+        :return: An instance of EmbeddingCache class named after the encoder's model and backend
+        """
+        return cls(model_key(model), **kwargs)
+
+    @staticmethod
+    def content_hash(text):
+        """
+        Returns the hash identifying a text in the cache.
+
+        :param text: The text to hash
+        :return: The SHA-256 digest of the UTF-8 encoded text
+        """
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def encode_queries(self, texts, encode):
+        """
+        Returns the embeddings of query texts, looking them up in the in-memory LRU cache first.
+
+        :param texts: List of query texts
+        :param encode: Function encoding a list of texts into a matrix of embeddings, called for cache misses only
+        :return: A float32 matrix with one embedding per text
+        """
+        with self._lock:
+            found = {}
+            for text in texts:
+                key = self.content_hash(text)
+                if key in self.query_embeddings:
+                    self.query_embeddings.move_to_end(key)
+                    found[text] = self.query_embeddings[key]
+            missing = list(dict.fromkeys(text for text in texts if text not in found))
+            self.counters["query_hits"] += len(texts) - len(missing)
+            self.counters["query_misses"] += len(missing)
+        if missing:
+            embeddings = np.asarray(encode(missing), dtype='float32')
+            with self._lock:
+                for text, embedding in zip(missing, embeddings):
+                    found[text] = embedding
+                    self.query_embeddings[self.content_hash(text)] = embedding
+                while len(self.query_embeddings) > self.query_cache_size:
+                    self.query_embeddings.popitem(last=False)
+        return np.array([found[text] for text in texts], dtype='float32')
+
+    def encode_paragraphs(self, texts, encode):
+        """
+        Returns the embeddings of paragraph texts, looking them up in the persistent cache first.
+        Missing paragraphs are encoded once each, in a single call, and stored; repeats of a
+        paragraph within the same call count as hits.
+
+        :param texts: List of paragraph texts
+        :param encode: Function encoding a list of texts into a matrix of embeddings, called for cache misses only
+        :return: A float32 matrix with one embedding per text
+        """
+        keys = {text: self.content_hash(text) for text in texts}
+        with self._lock:
+            stored = self._read(list(set(keys.values())))
+        found = {text: stored[key] for text, key in keys.items() if key in stored}
+        missing = [text for text in keys if text not in found]
+        if missing:
+            embeddings = np.asarray(encode(missing), dtype='float32')
+            found.update(zip(missing, embeddings))
+            with self._lock:
+                self._connection.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                                             [(self.model_name, keys[text], embedding.tobytes())
+                                              for text, embedding in zip(missing, embeddings)])
+                self._connection.commit()
+        with self._lock:
+            self.counters["paragraph_hits"] += len(texts) - len(missing)
+            self.counters["paragraph_misses"] += len(missing)
+        return np.array([found[text] for text in texts], dtype='float32')
+
+    def _read(self, keys, chunk_size=500):
+        """
+        Reads stored paragraph embeddings of the cache's model.
+
+        :param keys: List of content hashes to look up
+        :param chunk_size: Number of hashes per SQL query, below SQLite's variable limit (default: 500)
+        :return: A dictionary mapping the hashes found to their embeddings
+        """
+        stored = {}
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            rows = self._connection.execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({', '.join('?' * len(chunk))})",
+                [self.model_name, *chunk])
+            for key, vector in rows:
+                stored[key] = np.frombuffer(vector, dtype='float32')
+        return stored
+
+    def stats(self):
+        """
+        Returns the hit and miss counters of both cache tiers, with their hit rates.
+
+        :return: A dictionary of counters and hit rates
+        """
+        with self._lock:
+            stats = dict(self.counters)
+        for tier in ("query", "paragraph"):
+            lookups = stats[f"{tier}_hits"] + stats[f"{tier}_misses"]
+            stats[f"{tier}_hit_rate"] = stats[f"{tier}_hits"] / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        """
+        Closes the connection to the persistent cache.
+        """
+        self._connection.close()
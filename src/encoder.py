@@ -0,0 +1,135 @@
+import os
+import threading
+import numpy as np
+
+MODEL_NAME = 'sentence-transformers/paraphrase-distilroberta-base-v1'
+BACKENDS = ("torch", "quantized", "onnx")
+
+_models = {}  # Loaded models shared by all encoders of the process, keyed by (model name, backend, local files only)
+_encoders = {}  # Encoders returned by get_encoder, keyed by all of their settings
+_lock = threading.Lock()
+
+
+class SentenceEncoder:
+    """
+    A class to encode texts with a sentence transformer model that is loaded lazily, on first use,
+    and shared by every encoder of the process using the same model and backend.
+
+    Backends:
+        "torch": the sentence-transformers model as is.
+        "quantized": the torch model with its linear layers dynamically quantized to int8, for faster CPU inference.
+        "onnx": the sentence-transformers ONNX Runtime backend (requires sentence-transformers[onnx]).
+    """
+
+    def __init__(self, model_name=MODEL_NAME, backend="torch", batch_size=32, num_threads=None,
+                 local_files_only=False):
+        """
+        Initialize SentenceEncoder class without loading the model.
+
+        :param model_name: The name or path of the sentence transformer model (default: distilroberta paraphrase model)
+        :param backend: One of "torch", "quantized" or "onnx" (default: "torch")
+        :param batch_size: The number of texts encoded per forward pass (default: 32)
+        :param num_threads: The number of threads torch uses for inference (default: torch's own default)
+        :param local_files_only: Whether to load the model from the local cache only, without network access
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {', '.join(BACKENDS)}.")
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.local_files_only = local_files_only
+
+    @property
+    def model(self):
+        """
+        The shared sentence transformer model, loaded on first access.
+        """
+        key = (self.model_name, self.backend, self.local_files_only)
+        model = _models.get(key)
+        if model is None:
+            with _lock:
+                model = _models.get(key)
+                if model is None:
+                    model = _models[key] = self._load()
+        return model
+
+    @property
+    def loaded(self):
+        """
+        Whether the shared model has been loaded already.
+        """
+        return (self.model_name, self.backend, self.local_files_only) in _models
+
+    def _load(self):
+        """
+        Loads the model for the encoder's backend.
+
+        :return: A SentenceTransformer instance
+        """
+        from sentence_transformers import SentenceTransformer
+        if self.num_threads:
+            import torch
+            torch.set_num_threads(self.num_threads)
+        if self.backend == "onnx":
+            return SentenceTransformer(self.model_name, device="cpu", backend="onnx",
+                                       local_files_only=self.local_files_only)
+        if self.backend == "quantized":
+            import torch
+            model = SentenceTransformer(self.model_name, device="cpu", local_files_only=self.local_files_only)
+            return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return SentenceTransformer(self.model_name, local_files_only=self.local_files_only)
+
+    def encode(self, texts, **kwargs):
+        """
+        Encodes texts into sentence embeddings.
+
+        :param texts: List of texts to encode
+        :return: A float32 matrix with one embedding per text
+        """
+        kwargs.setdefault("batch_size", self.batch_size)
+        return np.asarray(self.model.encode(texts, **kwargs), dtype='float32')
+
+    def get_sentence_embedding_dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    @property
+    def tokenizer(self):
+        """
+        The Hugging Face tokenizer of the model, or None if the model has none.
+        """
+        return getattr(self.model, "tokenizer", None)
+
+    @property
+    def max_seq_length(self):
+        """
+        The number of tokens, including special tokens, beyond which the model truncates its input.
+        """
+        return self.model.max_seq_length
+
+
+def get_encoder(model_name=None, backend=None, batch_size=None, num_threads=None, local_files_only=None):
+    """
+    Returns the process-wide encoder with the given settings, creating it (but not loading its model) if needed.
+    Settings left out are read from the VECTOR_SEARCH_MODEL, VECTOR_SEARCH_BACKEND, VECTOR_SEARCH_BATCH_SIZE,
+    VECTOR_SEARCH_THREADS and VECTOR_SEARCH_LOCAL_FILES_ONLY environment variables, then from the defaults.
+
+    :param model_name: The name or path of the sentence transformer model
+    :param backend: One of "torch", "quantized" or "onnx"
+    :param batch_size: The number of texts encoded per forward pass
+    :param num_threads: The number of threads torch uses for inference
+    :param local_files_only: Whether to load the model from the local cache only
+    :return: A shared SentenceEncoder instance
+    """
+    settings = (
+        model_name or os.environ.get("VECTOR_SEARCH_MODEL", MODEL_NAME),
+        backend or os.environ.get("VECTOR_SEARCH_BACKEND", "torch"),
+        batch_size or int(os.environ.get("VECTOR_SEARCH_BATCH_SIZE", 32)),
+        num_threads or int(os.environ.get("VECTOR_SEARCH_THREADS", 0)) or None,
+        local_files_only if local_files_only is not None else
+        os.environ.get("VECTOR_SEARCH_LOCAL_FILES_ONLY", "") not in ("", "0", "false"),
+    )
+    with _lock:
+        if settings not in _encoders:
+            _encoders[settings] = SentenceEncoder(*settings)
+        return _encoders[settings]
@@ -0,0 +1,210 @@
+"""
+On-disk layout of saved indexes.
+
+An index is saved as a directory holding its files and a manifest.json describing them. Every save is
+written to a temporary directory, renamed to a "<name>.v-<id>" version once complete, and published by
+atomically replacing the "<name>" symbolic link with one pointing to it. Readers thus always see a complete
+index under its name, and the previous version is kept until the next save for readers still loading it.
+Indexes are listed by reading their manifests only.
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+import zlib
+import numpy as np
+
+FORMAT = "vector_search_index"
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+
+
+class IndexLoadError(Exception):
+    """
+    Raised when a saved index is missing, incomplete, corrupted or of an unsupported format.
+    """
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """
+    Returns the CRC-32 checksum of a file, read in chunks.
+
+    :param path: The path of the file
+    :param chunk_size: The number of bytes read at once (default: 1 MiB)
+    :return: The checksum as an unsigned integer
+    """
+    checksum = 0
+    with open(path, 'rb') as infile:
+        while chunk := infile.read(chunk_size):
+            checksum = zlib.crc32(chunk, checksum)
+    return checksum
+
+
+def write_manifest(directory, manifest):
+    """
+    Adds the format, the creation time and the size and checksum of every file of the directory
+    to a manifest, writes it to the directory and flushes all files to disk.
+
+    :param directory: The directory of the index
+    :param manifest: A JSON serializable dictionary describing the index
+    :return: The manifest as written
+    """
+    files = {}
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if filename.startswith(MANIFEST) or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as infile:
+            os.fsync(infile.fileno())
+        files[filename] = {"size": os.path.getsize(path), "crc32": file_checksum(path)}
+    manifest = {"format": FORMAT, "version": FORMAT_VERSION, "created": time.time(), **manifest, "files": files}
+    manifest_path = os.path.join(directory, MANIFEST)
+    with open(manifest_path + ".tmp", 'w') as outfile:
+        json.dump(manifest, outfile, indent=2)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(manifest_path + ".tmp", manifest_path)  # Also replaces the manifest of a live directory atomically
+    return manifest
+
+
+def read_manifest(directory, verify=False):
+    """
+    Reads the manifest of a saved index and checks that its files are complete.
+
+    :param directory: The directory of the index
+    :param verify: Whether to also compare the checksums of the files, which reads them entirely (default: False)
+    :return: The manifest dictionary
+    :raises IndexLoadError: If the manifest is missing or unsupported, or a file is missing, truncated or corrupted
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST), 'r') as infile:
+            manifest = json.load(infile)
+    except (OSError, ValueError) as e:
+        raise IndexLoadError(f"No readable manifest in '{directory}'.") from e
+    if manifest.get("format") != FORMAT or manifest.get("version", 0) > FORMAT_VERSION:
+        raise IndexLoadError(f"'{directory}' has an unsupported format ({manifest.get('format')} "
+                             f"version {manifest.get('version')}).")
+    for filename, expected in manifest["files"].items():
+        path = os.path.join(directory, filename)
+        if not os.path.isfile(path) or os.path.getsize(path) != expected["size"]:
+            raise IndexLoadError(f"'{path}' is missing or does not have the size recorded in the manifest.")
+        if verify and file_checksum(path) != expected["crc32"]:
+            raise IndexLoadError(f"'{path}' does not match the checksum recorded in the manifest.")
+    return manifest
+
+
+def _versions(path):
+    """
+    Returns the version directories of an index, newest first.
+    """
+    parent, name = os.path.split(os.path.normpath(path))
+    versions = [entry.path for entry in os.scandir(parent or ".")
+                if entry.name.startswith(f"{name}.v-") and entry.is_dir(follow_symlinks=False)]
+    return sorted(versions, key=os.path.getmtime, reverse=True)
+
+
+def resolve_directory(path):
+    """
+    Returns the version directory an index currently points to, so all of its files are read from the
+    same version even if it is saved again meanwhile.
+
+    :param path: The path of the index
+    :return: The real path of its current version
+    """
+    return os.path.realpath(path)
+
+
+def is_index_directory(path):
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def temporary_directory(path):
+    """
+    Creates an empty directory next to path, to write an index into before it is moved to path.
+
+    :param path: The final directory of the index
+    :return: The path of the temporary directory
+    """
+    path = os.path.normpath(path)
+    temporary = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+    os.makedirs(temporary)
+    return temporary
+
+
+def replace_directory(temporary, path):
+    """
+    Publishes a completely written index directory as the current version of the index, in a single atomic
+    rename of its link. The previous version is kept for readers still loading it, older ones are removed.
+    Processes that memory-mapped files of removed versions keep reading them.
+
+    :param temporary: The directory returned by temporary_directory
+    :param path: The path of the index
+    """
+    path = os.path.normpath(path)
+    version = f"{path}.v-{uuid.uuid4().hex[:8]}"
+    os.rename(temporary, version)
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+    _link(version, path)
+    for old_version in _versions(path):
+        if os.path.realpath(old_version) not in (os.path.realpath(version), previous):
+            shutil.rmtree(old_version, ignore_errors=True)
+
+
+def _link(version, path):
+    """
+    Atomically points the link of an index to one of its versions.
+    """
+    link = f"{path}.link-{uuid.uuid4().hex[:8]}"
+    os.symlink(os.path.basename(version), link)  # Relative, so the index can be moved with its versions
+    os.replace(link, path)
+
+
+def write_documents(path, documents):
+    """
+    Writes a document registry compactly, as the concatenated vector IDs of all documents and their offsets.
+
+    :param path: The path of the .npz file to write
+    :param documents: A dictionary mapping each document name to the vector IDs of its paragraphs
+    """
+    ids = [np.asarray(document_ids, dtype='int64') for document_ids in documents.values()]
+    offsets = np.zeros(len(ids) + 1, dtype='int64')
+    np.cumsum([len(document_ids) for document_ids in ids], out=offsets[1:])
+    with open(path, 'wb') as outfile:
+        np.savez(outfile, names=np.array(json.dumps(list(documents))), offsets=offsets,
+                 ids=np.concatenate(ids) if ids else np.empty(0, dtype='int64'))
+
+
+def read_documents(path):
+    """
+    Reads a document registry written by write_documents.
+
+    :param path: The path of the .npz file
+    :return: A dictionary mapping each document name to the vector IDs of its paragraphs
+    """
+    with np.load(path) as data:
+        names = json.loads(str(data["names"]))
+        offsets = data["offsets"]
+        ids = data["ids"].tolist()
+    return {name: ids[offsets[position]:offsets[position + 1]] for position, name in enumerate(names)}
+
+
+def list_indexes(directory="."):
+    """
+    Lists the saved indexes of a directory from their manifests, without opening their other files.
+    Indexes saved as "<name>.index" files by earlier versions are listed with their name only.
+
+    :param directory: The directory to look for indexes in (default: the working directory)
+    :return: A list of manifest dictionaries with an added "name" key, sorted by name
+    """
+    indexes = []
+    for entry in os.scandir(directory):
+        if entry.is_dir() and not any(part in entry.name for part in (".tmp-", ".v-", ".link-")):
+            try:
+                manifest = read_manifest(entry.path)
+            except IndexLoadError:
+                continue
+            indexes.append({"name": entry.name, **manifest})
+        elif entry.is_file() and entry.name.endswith(".index"):
+            indexes.append({"name": entry.name[:-len(".index")], "version": 0})
+    return sorted(indexes, key=lambda index: index["name"])
@@ -2,87 +2,677 @@ import json
 import numpy as np
 import faiss
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
-import re
 import os
+import shutil
+import time
+import uuid
+from src.ann_index import IndexConfig, supports_removal
+from src.chunking import Chunk, Chunker
+from src.metadata_store import MetadataStore
+from src.embedding_cache import model_key
+from src.bm25 import BM25Index, reciprocal_rank_fusion
+from src.index_store import (IndexLoadError, is_index_directory, read_documents, read_manifest, replace_directory,
+                             resolve_directory, temporary_directory, write_documents, write_manifest)
+from src.paragraph_store import ParagraphStore
+from src.vector_store import VectorStore
+from src.reranking import rerank_deadline, rerank_exact, rerank_results, top_k
+from src.encoder import MODEL_NAME, get_encoder
+from src.result_cache import normalize_query
+from src.metrics import metrics
+
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+
 
 class FaissIndexer:
     """
     A class to create, search and save/load a FAISS index for text search using Sentence Transformers.
     """
 
-    def __init__(self, uploaded_files=None):
+    def __init__(self, uploaded_files=None, index_config=None, embedding_cache=None, model=None, chunker=None,
+                 result_cache=None):
         """
         Initialize FaissIndexer class with a list of uploaded files.
 
         :param uploaded_files: List of file objects to be indexed
+        :param index_config: IndexConfig describing the kind of FAISS index to build (default: exact flat index)
+        :param embedding_cache: Optional EmbeddingCache to reuse paragraph and query embeddings from, created for
+                                the encoder's model, see EmbeddingCache.for_encoder
+        :param model: Optional sentence encoder; the process-wide encoder from get_encoder is used when omitted
+        :param chunker: Optional Chunker splitting documents into paragraphs (default: header-respecting
+                        sentence packing up to the model's maximum sequence length)
+        :param result_cache: Optional ResultCache to reuse the results of repeated searches from
+        :raises ValueError: If the embedding cache holds the embeddings of another model or backend
         """
         if uploaded_files:
             self.uploaded_files = uploaded_files
-        self.model = SentenceTransformer('sentence-transformers/paraphrase-distilroberta-base-v1')
+        self.model = model or get_encoder()
+        self.model_name = getattr(self.model, "model_name", MODEL_NAME)
+        if embedding_cache is not None and embedding_cache.model_name != model_key(self.model):
+            raise ValueError(f"The embedding cache holds embeddings of '{embedding_cache.model_name}', "
+                             f"not of '{model_key(self.model)}'.")
+        self.embedding_cache = embedding_cache
+        self.index_config = index_config or IndexConfig()
         self.index = None
-        self.paragraphs = []  # Change this line to store paragraphs instead of documents
+        self.paragraphs = []  # Paragraph texts indexed by vector ID; removed paragraphs are None
+        self.documents = {}  # Maps each document name to the vector IDs of its paragraphs
+        self.metadata = MetadataStore()  # Document, page, section and offsets of the paragraphs by vector ID
+        self._bm25 = BM25Index()  # None until built from the paragraphs of an index saved without one
+        self.vectors = self._vector_store()  # Full-precision embeddings by vector ID, kept for exact re-ranking
+        self._pending_batches = []  # Streamed (document name, chunks, embeddings, document IDs) batches not indexed yet
+        self._mmap_file = None  # Open index file the FAISS index is memory-mapped from, if any
+        self._chunker = chunker
+        self.result_cache = result_cache
+        self.version = uuid.uuid4().hex  # Identifies the indexed content, replaced on every modification
+
+    HYBRID_CANDIDATES = 50  # The number of results of each retriever that hybrid search fuses
+
+    @property
+    def bm25(self):
+        """
+        The BM25 inverted index of the paragraphs, built on first use for indexes saved without one.
+        """
+        if self._bm25 is None:
+            self._bm25 = BM25Index()
+            self._bm25.add([None if paragraph is None else
+                            self._lexical_text(paragraph, (self.get_metadata(i) or {}).get("header"))
+                            for i, paragraph in enumerate(self.paragraphs)])
+        return self._bm25
+
+    @staticmethod
+    def _lexical_text(text, header):
+        """
+        Returns the text of a paragraph indexed for lexical search: the paragraph prefixed with its
+        section header, so searching a section number or title finds the paragraphs of the section.
+        """
+        if header and not text.startswith(header):
+            return f"{header}\n{text}"
+        return text
+
+    @property
+    def cache_version(self):
+        """
+        The version of the index that cached search results are keyed by: the version of its content
+        and its search settings.
+        """
+        return f"{self.version}:{json.dumps(self.index_config.to_dict(), sort_keys=True)}"
+
+    def _modified(self):
+        """
+        Gives the index a new version, so results cached for its previous content are not returned anymore.
+        """
+        self.version = uuid.uuid4().hex
+
+    def _vector_store(self):
+        return VectorStore() if self.index_config.rerank == "exact" else None
+
+    @property
+    def chunker(self):
+        """
+        The Chunker splitting documents into paragraphs, sized for the model when created on first use.
+        """
+        if self._chunker is None:
+            self._chunker = Chunker.for_encoder(self.model)
+        return self._chunker
+
+    @staticmethod
+    def document_name(uploaded_file):
+        """
+        Returns the name under which an uploaded file is registered in the index.
+
+        :param uploaded_file: A file path or a file object with a ``name`` attribute
+        :return: The file name without its extension
+        """
+        return Path(getattr(uploaded_file, "name", uploaded_file)).stem
+
+    def _read_chunks(self, uploaded_file):
+        """
+        Reads the parsed JSON file of an uploaded file and splits it into chunks with the chunker.
+        Files written before the parser recorded blocks are chunked from their joined document text.
+
+        :param uploaded_file: A file path or a file object with a ``name`` attribute
+        :return: A list of Chunk objects
+        """
+        document_name = self.document_name(uploaded_file)
+        with metrics.span("read_json"), open(document_name + ".json", 'r') as infile:
+            data = json.load(infile)
+            metrics.count("json_bytes_read", infile.tell())
+        blocks = data.get("blocks") or [data["document_content"]]
+        with metrics.span("chunk"):
+            chunks = list(self.chunker.chunk(blocks, document_name))
+        metrics.count("chunks", len(chunks))
+        return chunks
+
+    def _encode(self, texts):
+        """
+        Encodes texts with the sentence transformer model.
+
+        :param texts: List of texts to encode
+        :return: A float32 matrix with one embedding per text
+        """
+        metrics.count("texts_encoded", len(texts))
+        return np.array(self.model.encode(texts)).astype('float32')
+
+    def _encode_paragraphs(self, paragraphs):
+        """
+        Encodes paragraphs, reusing the persistent embeddings of the embedding cache if there is one.
+
+        :param paragraphs: List of paragraph texts to encode
+        :return: A float32 matrix with one embedding per paragraph
+        """
+        with metrics.span("encode.paragraphs"):
+            if self.embedding_cache is None:
+                return self._encode(paragraphs)
+            return self.embedding_cache.encode_paragraphs(paragraphs, self._encode)
+
+    def _encode_queries(self, queries):
+        """
+        Encodes query texts, reusing the in-memory query embeddings of the embedding cache if there is one.
+
+        :param queries: List of query texts to encode
+        :return: A float32 matrix with one embedding per query
+        """
+        with metrics.span("encode.queries"):
+            if self.embedding_cache is None:
+                return self._encode(queries)
+            return self.embedding_cache.encode_queries(queries, self._encode)
+
+    def _ensure_writable(self):
+        """
+        Replaces a memory-mapped index and paragraph store by in-memory copies before they are modified.
+        """
+        if self._mmap_file is not None:
+            # Read through the file opened at load time, which stays readable after a newer save replaced it
+            self._mmap_file.seek(0)
+            self.index = faiss.read_index(faiss.PyCallbackIOReader(self._mmap_file.read))
+            self._mmap_file.close()
+            self._mmap_file = None
+        if isinstance(self.paragraphs, ParagraphStore):
+            self.paragraphs = list(self.paragraphs)
+
+    def _ensure_id_map(self):
+        """
+        Wraps a plain flat index (e.g. one loaded from an older save) into an ID-mapped index,
+        so paragraphs can be added and removed by vector ID.
+        """
+        if isinstance(self.index, faiss.IndexFlat):
+            vectors = self.index.reconstruct_n(0, self.index.ntotal)
+            id_map = faiss.IndexIDMap2(faiss.IndexFlatL2(self.index.d))
+            id_map.add_with_ids(vectors, np.arange(self.index.ntotal, dtype='int64'))
+            self.index = id_map
 
     def build_index(self):
         """
         Builds the FAISS index using the uploaded files.
         """
-        for uploaded_file in self.uploaded_files:
-            input_filename = Path(uploaded_file)
-            output_filename = input_filename.stem + ".json"
-            with open(output_filename, 'r') as infile:
-                data = json.load(infile)
-                document_text = data["document_content"]
-                paragraphs = re.split(r'\n\n|\.\s+(?=\S)', document_text)  # Split document into paragraphs
-                self.paragraphs.extend(paragraphs)  # Add the paragraphs to self.paragraphs
+        self.index = None
+        self.paragraphs = []
+        self.documents = {}
+        self.metadata = MetadataStore()
+        self._bm25 = BM25Index()
+        self.vectors = self._vector_store()
+        self._pending_batches = []
+        self._modified()
+        self.add_documents(self.uploaded_files)
+
+    def add_documents(self, uploaded_files):
+        """
+        Adds new documents to the index, encoding only their paragraphs.
 
-        embeddings = self.model.encode(self.paragraphs)
-        d = embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(d)
-        self.index.add(np.array(embeddings).astype('float32'))
+        :param uploaded_files: List of file objects to be added to the index
+        :return: The number of paragraphs added
+        """
+        new_documents = {}
+        new_paragraphs = []
+        next_id = len(self.paragraphs)
+        for uploaded_file in uploaded_files:
+            document_name = self.document_name(uploaded_file)
+            if document_name in self.documents or document_name in new_documents:
+                raise ValueError(f"Document '{document_name}' is already indexed, use replace_document instead.")
+            chunks = self._read_chunks(uploaded_file)
+            new_documents[document_name] = chunks
+            new_paragraphs.extend(chunk.text for chunk in chunks)
+            next_id += len(chunks)
+        if not new_paragraphs:
+            return 0
+
+        embeddings = self._encode_paragraphs(new_paragraphs)
+        if self.index is None:
+            with metrics.span("index.train"):
+                self.index = self.index_config.create_index(embeddings)
+        self._ensure_writable()
+        self._ensure_id_map()
+        ids = np.arange(len(self.paragraphs), next_id, dtype='int64')
+        with metrics.span("index.add"):
+            self.index.add_with_ids(embeddings, ids)
+        metrics.count("vectors_added", len(ids))
+        if self.vectors is not None:
+            self.vectors.append(embeddings)
+        with metrics.span("bm25.add"):
+            self.bm25.add([self._lexical_text(chunk.text, chunk.header)
+                           for chunks in new_documents.values() for chunk in chunks])
+        self.paragraphs.extend(new_paragraphs)
+        for document_name, chunks in new_documents.items():
+            self.documents[document_name] = list(range(len(self.metadata), len(self.metadata) + len(chunks)))
+            self.metadata.append(document_name, chunks)
+        self._modified()
+        return len(new_paragraphs)
+
+    def add_stream(self, document_name, paragraphs, batch_size=256, expected_size=None, flush=True,
+                   embedded_batches=(), on_batch=None):
+        """
+        Adds a document from an iterable of paragraphs, encoding and indexing them in fixed-size batches
+        as they arrive, so memory use is bounded by the batch size rather than the document size.
+        If the index still has to be trained, batches are held back until there are enough training vectors.
+
+        :param document_name: The name under which the document is registered
+        :param paragraphs: Iterable of paragraph texts or Chunk objects, e.g. a generator
+        :param batch_size: The number of paragraphs encoded and added at once (default: 256)
+        :param expected_size: Optional estimate of the corpus size, used to pick and train the index
+        :param flush: Whether to add held back batches at the end of the document; pass False when more
+                      documents are streamed next and call flush_stream after the last one (default: True)
+        :param embedded_batches: Optional (chunks, embeddings) batches of the first paragraphs of the document,
+                                 already encoded e.g. by an interrupted build; they are added before paragraphs
+        :param on_batch: Optional function called with the chunks and embeddings of every newly encoded batch
+        :return: The number of paragraphs added
+        """
+        if document_name in self.documents:
+            raise ValueError(f"Document '{document_name}' is already indexed, use replace_document instead.")
+        self.documents[document_name] = ids = []
+        count = 0
+        for chunks, embeddings in embedded_batches:
+            self._add_stream_batch(document_name, chunks, ids, expected_size, embeddings)
+            count += len(chunks)
+        batch = []
+        for paragraph in paragraphs:
+            batch.append(paragraph if isinstance(paragraph, Chunk) else Chunk(paragraph, document_name))
+            if len(batch) == batch_size:
+                self._add_stream_batch(document_name, batch, ids, expected_size, on_batch=on_batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self._add_stream_batch(document_name, batch, ids, expected_size, on_batch=on_batch)
+            count += len(batch)
+        if flush:
+            self.flush_stream()
+        return count
 
-    def search_index(self, query_text, k=5):
+    def _add_stream_batch(self, document_name, batch, ids, expected_size, embeddings=None, on_batch=None):
+        """
+        Encodes a batch of streamed paragraphs and adds it to the index, unless the index
+        still waits for enough vectors to be trained.
+
+        :param document_name: The name of the document being streamed
+        :param batch: List of Chunk objects
+        :param ids: The vector ID list of the document being streamed, extended when the batch is added
+        :param expected_size: Optional estimate of the corpus size, used to pick and train the index
+        :param embeddings: The embeddings of the batch if it is already encoded
+        :param on_batch: Optional function called with the chunks and embeddings once the batch is encoded
+        """
+        if embeddings is None:
+            metrics.count("chunks", len(batch))
+            embeddings = self._encode_paragraphs([chunk.text for chunk in batch])
+            if on_batch is not None:
+                on_batch(batch, embeddings)
+        self._pending_batches.append((document_name, batch, embeddings, ids))
+        if self.index is None:
+            buffered = sum(len(chunks) for _, chunks, _, _ in self._pending_batches)
+            if buffered < self.index_config.required_training_size(expected_size):
+                return
+        self.flush_stream(expected_size)
+
+    def flush_stream(self, expected_size=None):
+        """
+        Adds the streamed batches held back for training, creating the index from them if needed.
+
+        :param expected_size: Optional estimate of the corpus size, used to pick and train the index
+        """
+        if not self._pending_batches:
+            return
+        if self.index is None:
+            embeddings = np.concatenate([embeddings for _, _, embeddings, _ in self._pending_batches])
+            if len(embeddings) < self.index_config.required_training_size(expected_size):
+                expected_size = None  # The stream ended before reaching the expected size
+            with metrics.span("index.train"):
+                self.index = self.index_config.create_index(embeddings, n_vectors=expected_size)
+        self._ensure_writable()
+        self._ensure_id_map()
+        for document_name, chunks, embeddings, ids in self._pending_batches:
+            new_ids = np.arange(len(self.paragraphs), len(self.paragraphs) + len(chunks), dtype='int64')
+            with metrics.span("index.add"):
+                self.index.add_with_ids(embeddings, new_ids)
+            metrics.count("vectors_added", len(new_ids))
+            if self.vectors is not None:
+                self.vectors.append(embeddings)
+            with metrics.span("bm25.add"):
+                self.bm25.add([self._lexical_text(chunk.text, chunk.header) for chunk in chunks])
+            self.paragraphs.extend(chunk.text for chunk in chunks)
+            self.metadata.append(document_name, chunks)
+            ids.extend(new_ids.tolist())
+        self._pending_batches = []
+        self._modified()
+
+    def remove_document(self, document_name):
+        """
+        Removes a document and all of its paragraphs from the index.
+
+        :param document_name: The name of the document, as registered by add_documents
+        :return: The number of paragraphs removed
+        :raises ValueError: If the index is an HNSW index, which does not support removals
+        """
+        ids = self.documents.get(document_name)
+        if ids is None:
+            return 0
+        # Streamed batches of the document held back for training, e.g. of a stream that raised partway
+        self._pending_batches = [batch for batch in self._pending_batches if batch[0] != document_name]
+        if not ids:  # Registered without any paragraph indexed, e.g. an image-only PDF
+            del self.documents[document_name]
+            return 0
+        if not supports_removal(self.index):
+            raise ValueError(f"Cannot remove '{document_name}': documents cannot be removed from an HNSW index, "
+                             f"rebuild the index without it instead.")
+        self._ensure_writable()
+        self._ensure_id_map()
+        with metrics.span("index.remove"):
+            self.index.remove_ids(np.array(ids, dtype='int64'))
+        metrics.count("vectors_removed", len(ids))
+        del self.documents[document_name]
+        for i in ids:
+            self.paragraphs[i] = None
+        self.metadata.remove(ids)
+        self.bm25.remove(ids)
+        self._modified()
+        return len(ids)
+
+    def replace_document(self, uploaded_file):
+        """
+        Replaces the paragraphs of an already indexed document with its current content,
+        or adds it if it is not indexed yet.
+
+        :param uploaded_file: The file object of the document to be replaced
+        :return: The number of paragraphs added
+        """
+        self.remove_document(self.document_name(uploaded_file))
+        return self.add_documents([uploaded_file])
+
+    def search_index(self, query_text, k=5, filters=None, mode="vector"):
         """
         Searches the FAISS index for the most similar paragraphs to the query_text.
 
         :param query_text: The query text to search for in the index
         :param k: The number of top results to return (default: 5)
-        :return: A tuple containing distances and the matching paragraphs
+        :param filters: Optional dictionary restricting the search by "document", "page" and/or "section",
+                        see MetadataStore.mask
+        :param mode: "vector" for embedding search, "lexical" for BM25 keyword search, or "hybrid" to fuse
+                     both rankings (default: "vector")
+        :return: A tuple containing distances (scores for lexical and hybrid search), IDs and the matching paragraphs
+        """
+        D, I, search_results = self.search_batch([query_text], k, filters, mode)
+        return D, I, search_results[0]
+
+    def search_batch(self, queries, k=5, filters=None, mode="vector"):
         """
-        query_embedding = self.model.encode([query_text])[0]
-        D, I = self.index.search(np.array([query_embedding]).astype('float32'), k)
-        search_results = [self.paragraphs[i] for i in I[0]]  # Retrieve paragraph texts based on indices
-        return D, I, search_results
+        Searches the FAISS index for several query texts at once, encoding them in one batch
+        and running a single FAISS search over all of their embeddings.
+
+        :param queries: List of query texts to search for in the index
+        :param k: The number of top results to return per query (default: 5)
+        :param filters: Optional dictionary of filters applied to all queries, see search_index
+        :param mode: "vector", "lexical" or "hybrid", see search_index (default: "vector")
+        :return: A tuple containing the distance (or score) and ID matrices, one row per query,
+                 and a list with the matching paragraphs of each query
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {', '.join(SEARCH_MODES)}.")
+        queries = list(queries)
+        if not queries:
+            return np.empty((0, k), dtype='float32'), np.empty((0, k), dtype='int64'), []
+        start = time.perf_counter()
+        if self.result_cache is not None:
+            results = self._search_cached(queries, k, filters, mode)
+        else:
+            results = self._search(queries, k, filters, mode)
+        metrics.observe("search_seconds", time.perf_counter() - start, mode=mode)
+        metrics.count("queries", len(queries), mode=mode)
+        return results
+
+    def _search_cached(self, queries, k, filters, mode):
+        """
+        Looks the queries up in the result cache and searches the index for the others only,
+        caching their results. Queries are normalized, see normalize_query.
+        """
+        queries = [normalize_query(query_text) for query_text in queries]
+        keys = [self.result_cache.key(self.cache_version, query_text, k, filters, mode) for query_text in queries]
+        results = [self.result_cache.get(key) for key in keys]
+        missing = [position for position, result in enumerate(results) if result is None]
+        if missing:
+            start = time.perf_counter()
+            D, I, search_results = self._search([queries[position] for position in missing], k, filters, mode)
+            elapsed = (time.perf_counter() - start) / len(missing)
+            for row, position in enumerate(missing):
+                results[position] = (D[row].copy(), I[row].copy(), search_results[row])
+                self.result_cache.put(keys[position], results[position], elapsed)
+        return (np.array([result[0] for result in results]), np.array([result[1] for result in results]),
+                [list(result[2]) for result in results])
+
+    def _search(self, queries, k, filters, mode):
+        start = time.perf_counter()
+        cross_encode = self.index_config.rerank == "cross-encoder"
+        n_results = k * self.index_config.rerank_candidates if cross_encode else k
+        if mode == "lexical":
+            results = self.search_lexical(queries, n_results, filters)
+        else:
+            candidates = max(n_results, self.HYBRID_CANDIDATES) if mode == "hybrid" else n_results
+            results = self.search_embeddings(self._encode_queries(queries), candidates, filters)
+            if mode == "hybrid":
+                results = reciprocal_rank_fusion([results, self.search_lexical(queries, candidates, filters)],
+                                                 n_results)
+        if not cross_encode:
+            return results
+        return top_k(rerank_results(self.index_config, queries, results, start), k)
+
+    def search_lexical(self, queries, k=5, filters=None):
+        """
+        Searches the BM25 inverted index for the paragraphs best matching the terms of several query texts,
+        e.g. part numbers or section numbers that embeddings do not capture exactly.
+
+        :param queries: List of query texts to search for in the index
+        :param k: The number of top results to return per query (default: 5)
+        :param filters: Optional dictionary of filters applied to all queries, see search_index
+        :return: A tuple containing the BM25 score and ID matrices, one row per query, best first,
+                 and a list with the matching paragraphs of each query
+        """
+        mask = self.metadata.mask(filters) if filters else None
+        with metrics.span("bm25.search"):
+            scores, I = self.bm25.search(queries, k, mask)
+        search_results = [[self.paragraphs[i] for i in row if i != -1] for row in I]
+        return scores, I, search_results
+
+    def search_embeddings(self, query_embeddings, k=5, filters=None):
+        """
+        Searches the FAISS index for the paragraphs closest to already encoded queries.
+        Filters are applied by FAISS during the search, through an ID selector. With exact re-ranking,
+        rerank_candidates times more candidates are searched and ordered by their exact distance.
+
+        :param query_embeddings: A float32 matrix with one query embedding per row
+        :param k: The number of top results to return per query (default: 5)
+        :param filters: Optional dictionary of filters applied to all queries, see search_index
+        :return: A tuple containing the distance and ID matrices, one row per query,
+                 and a list with the matching paragraphs of each query
+        """
+        start = time.perf_counter()
+        rerank = self.index_config.rerank == "exact"
+        if rerank and (self.vectors is None or len(self.vectors) < len(self.paragraphs)):
+            raise ValueError("The index was built without full-precision vectors, rebuild it to re-rank exactly.")
+        n_candidates = k * self.index_config.rerank_candidates if rerank else k
+        selector = self._selector(filters) if filters else None
+        params = self.index_config.search_parameters(self.index, selector)
+        with metrics.span("index.search"):
+            D, I = self.index.search(query_embeddings, n_candidates, params=params)
+        search_results = [[self.paragraphs[i] for i in row if i != -1] for row in I]  # Retrieve paragraph texts based on IDs
+        if not rerank:
+            return D, I, search_results
+        deadline = rerank_deadline(self.index_config.rerank_budget_ms, start)
+        with metrics.span("rerank.exact"):
+            results, reranked = rerank_exact(query_embeddings, (D, I, search_results), self.vectors, deadline)
+        metrics.count("queries_reranked", reranked, reranker="exact")
+        metrics.count("queries_not_reranked", len(I) - reranked, reranker="exact")
+        return top_k(results, k)
+
+    def _selector(self, filters):
+        """
+        Returns a FAISS ID selector for the paragraphs matching filters.
+
+        :param filters: A dictionary of filters, see MetadataStore.mask
+        :return: A faiss.IDSelector instance
+        """
+        mask = self.metadata.mask(filters)
+        ids = np.flatnonzero(mask)
+        if len(ids) * 32 < len(mask):  # A hash set of few IDs is smaller and faster to build than a bitmap
+            return faiss.IDSelectorBatch(ids.astype('int64'))
+        bitmap = np.packbits(mask, bitorder='little')
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        selector.referenced_objects = [bitmap]  # The selector does not own the bitmap
+        return selector
+
+    def get_metadata(self, i):
+        """
+        Returns the source of a paragraph returned by a search.
+
+        :param i: The vector ID of the paragraph
+        :return: A dictionary with "document", "page", "header", "start" and "end" keys, or None if removed
+        """
+        return self.metadata.get(int(i))
 
 
     def save_index(self, index_name):
         """
-        Saves the FAISS index and the associated paragraphs to files.
+        Saves the FAISS index, the associated paragraphs, metadata and BM25 index, the document registry
+        and the full-precision vectors of exact re-ranking to the directory index_name, with a manifest describing
+        them. The directory is written under a temporary name and renamed once complete, replacing a previous
+        version of the index.
 
-        :param index_name: The name of the index to be saved
+        :param index_name: The name of the index to be saved, i.e. the path of its directory
         """
-        index_filename = f"{index_name}.index"
-        faiss.write_index(self.index, index_filename)
-        with open(f"{index_name}_paragraphs.json", 'w') as outfile:
-            json.dump(self.paragraphs, outfile)
+        directory = temporary_directory(index_name)
+        try:
+            with metrics.span("index.save"):
+                faiss.write_index(self.index, os.path.join(directory, "index.faiss"))
+                ParagraphStore.write(os.path.join(directory, "paragraphs.bin"), self.paragraphs)
+                write_documents(os.path.join(directory, "documents.npz"), self.documents)
+                self.metadata.save(os.path.join(directory, "metadata.npz"))
+                self.bm25.save(os.path.join(directory, "bm25.npz"))
+                if self.vectors is not None:
+                    self.vectors.save(os.path.join(directory, "vectors.npy"))
+                manifest = write_manifest(directory, {
+                    "kind": "faiss",
+                    "model_name": self.model_name,
+                    "dimension": self.index.d,
+                    "index_type": self.index_config.index_type,
+                    "index_config": self.index_config.to_dict(),
+                    "content_version": self.version,
+                    "counts": {"vectors": int(self.index.ntotal), "ids": len(self.paragraphs),
+                               "paragraphs": sum(len(ids) for ids in self.documents.values()),
+                               "documents": len(self.documents)},
+                })
+            replace_directory(directory, index_name)
+            metrics.count("index_bytes_written", sum(file["size"] for file in manifest["files"].values()))
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
 
     @classmethod
-    def load_index(cls, index_name):
+    def load_index(cls, index_name, embedding_cache=None, mmap=False, model=None, verify=False, result_cache=None):
         """
-        Loads a FAISS index and the associated paragraphs from files.
+        Loads a FAISS index, the associated paragraphs, metadata and BM25 index and the document registry
+        from the directory written by save_index. Indexes saved as ".index" files by earlier versions are loaded too.
+
+        With mmap, the FAISS index and the binary paragraph store are memory-mapped instead of read into RAM,
+        so loading is near-instant, paragraphs are decoded only when returned by a search, and processes
+        loading the same index share its pages. They are copied into memory on the first modification.
+        The full-precision vectors of exact re-ranking are always memory-mapped, as few of them are read per search.
 
-        :param index_name: The name of the index to be loaded
-        :return: An instance of FaissIndexer class with the loaded index, or None if an error occurs
+        :param index_name: The name of the index to be loaded, i.e. the path of its directory
+        :param embedding_cache: Optional EmbeddingCache to reuse query embeddings from
+        :param mmap: Whether to memory-map the index and the paragraphs (default: False)
+        :param model: Optional sentence encoder; the process-wide encoder from get_encoder is used when omitted
+        :param verify: Whether to compare the checksums of all files with the manifest, which reads them entirely
+                       (default: False, only their sizes are checked)
+        :param result_cache: Optional ResultCache to reuse the results of repeated searches from; processes
+                             loading the same saved index share its cached results
+        :return: An instance of FaissIndexer class with the loaded index
+        :raises IndexLoadError: If the index is missing, incomplete, corrupted, or was built with another model
+        """
+        if not is_index_directory(index_name) and os.path.exists(f"{index_name}.index"):
+            return cls._load_files(index_name, embedding_cache, mmap, model, result_cache)
+        directory = resolve_directory(index_name)  # Read all files from one version, even if saved again meanwhile
+        manifest = read_manifest(directory, verify=verify)
+        if manifest.get("kind") != "faiss":
+            raise IndexLoadError(f"'{index_name}' is a {manifest.get('kind')} index, not a FaissIndexer index.")
+        indexer = cls(None, index_config=IndexConfig.from_dict(manifest["index_config"]),
+                      embedding_cache=embedding_cache, model=model, result_cache=result_cache)
+        indexer.version = manifest.get("content_version", indexer.version)
+        if manifest["model_name"] != indexer.model_name:
+            raise IndexLoadError(f"'{index_name}' was built with the model {manifest['model_name']}, "
+                                 f"not {indexer.model_name}.")
+        try:
+            with metrics.span("index.load"):
+                index_filename = os.path.join(directory, "index.faiss")
+                if mmap:
+                    indexer.index = cls._mmap_index(index_filename)
+                    indexer._mmap_file = open(index_filename, 'rb')
+                    indexer.paragraphs = ParagraphStore(os.path.join(directory, "paragraphs.bin"))
+                else:
+                    indexer.index = faiss.read_index(index_filename)
+                    store = ParagraphStore(os.path.join(directory, "paragraphs.bin"))
+                    indexer.paragraphs = list(store)
+                    store.close()
+                indexer.documents = read_documents(os.path.join(directory, "documents.npz"))
+                indexer.metadata = MetadataStore.load(os.path.join(directory, "metadata.npz"))
+                indexer._bm25 = BM25Index.load(os.path.join(directory, "bm25.npz"))
+                if "vectors.npy" in manifest["files"]:
+                    indexer.vectors = VectorStore.load(os.path.join(directory, "vectors.npy"))
+        except Exception as e:
+            raise IndexLoadError(f"Could not load index '{index_name}': {e}") from e
+        metrics.count("index_bytes_loaded", sum(file["size"] for file in manifest["files"].values()))
+        return indexer
+
+    @classmethod
+    def _load_files(cls, index_name, embedding_cache=None, mmap=False, model=None, result_cache=None):
+        """
+        Loads an index saved as "<index_name>.index" and "<index_name>_paragraphs.json" files by earlier
+        versions. Its paragraphs belong to no registered document, and its BM25 index is built on first use.
+
+        :return: An instance of FaissIndexer class with the loaded index
+        :raises IndexLoadError: If a file cannot be read
         """
         try:
             index_filename = f"{index_name}.index"
-            index = faiss.read_index(index_filename)
+            if mmap:
+                index = cls._mmap_index(index_filename)
+            else:
+                index = faiss.read_index(index_filename)
             with open(f"{index_name}_paragraphs.json", 'r') as infile:
                 paragraphs = json.load(infile)
-            indexer = cls(None)
+            indexer = cls(None, embedding_cache=embedding_cache, model=model, result_cache=result_cache)
             indexer.index = index
+            indexer._mmap_file = open(index_filename, 'rb') if mmap else None
             indexer.paragraphs = paragraphs
+            indexer.metadata = MetadataStore.from_documents({}, len(paragraphs))
+            indexer._bm25 = None
             return indexer  # Return the instance of FaissIndexer with the loaded index
         except Exception as e:
-            return None  # Return None if there was an error loading the index
+            raise IndexLoadError(f"Could not load index '{index_name}': {e}") from e
+
+    @staticmethod
+    def _mmap_index(index_filename):
+        """
+        Memory-maps a FAISS index file. Flat vector storage (flat and HNSW indexes) is mapped when
+        supported by the installed FAISS version, IVF indexes have their inverted lists mapped.
 
+        :param index_filename: The path of the index file
+        :return: The memory-mapped, read-only FAISS index
+        """
+        try:
+            return faiss.read_index(index_filename, faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0))
+        except RuntimeError:
+            return faiss.read_index(index_filename, faiss.IO_FLAG_MMAP)  # IVF inverted lists only support IO_FLAG_MMAP
@@ -0,0 +1,438 @@
+"""
+Index builds that run in a background thread, report their progress and can be resumed.
+
+Every job keeps its state in a directory: job.json with its settings and state, the uploaded files,
+and a checkpoint of every batch of paragraphs embedded so far. A build interrupted by an error,
+a cancellation or a restart of the process resumes from these checkpoints, re-parsing documents
+but only encoding the paragraphs that were not embedded yet. Once the build finishes, the index is
+saved atomically and the finished indexer replaces the one in use with a single assignment.
+"""
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count, islice
+import fitz
+import numpy as np
+from src.ann_index import IndexConfig
+from src.chunking import Chunk, Chunker
+from src.encoder import get_encoder
+from src.indexer import FaissIndexer
+from src.parse_document import LocalFile, PdfParser
+from src.pipeline import IngestPipeline
+
+STATES = ("queued", "running", "done", "failed", "cancelled")
+OWNER = f"{socket.gethostname()}:{os.getpid()}"  # Recorded in the jobs this process runs
+HEARTBEAT_S = 5  # How often a queued or running job records that its process is still alive
+
+
+class JobCancelled(Exception):
+    """
+    Raised in a build's thread to stop it when its job is cancelled.
+    """
+
+
+def _write_json(path, data):
+    with open(path + ".tmp", 'w') as outfile:
+        json.dump(data, outfile)
+    os.replace(path + ".tmp", path)
+
+
+class BatchCheckpoint:
+    """
+    A class to store the embedded batches of the documents of a build, one .npz file per batch,
+    and mark the documents whose batches are all stored.
+    """
+
+    def __init__(self, directory):
+        """
+        Initialize BatchCheckpoint class.
+
+        :param directory: The directory the batches are stored in, created if needed
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, document, number):
+        return os.path.join(self.directory, f"{document}_{number}.npz")
+
+    def save(self, document, number, chunks, embeddings):
+        """
+        Stores an embedded batch.
+
+        :param document: The position of the document in the build
+        :param number: The position of the batch in the document
+        :param chunks: List of Chunk objects
+        :param embeddings: The float32 matrix of their embeddings
+        """
+        path = self._path(document, number)
+        with open(path + ".tmp", 'wb') as outfile:
+            np.savez(outfile, embeddings=embeddings,
+                     chunks=np.array(json.dumps([chunk.to_dict() for chunk in chunks])))
+        os.replace(path + ".tmp", path)  # A batch is either stored completely or not at all
+
+    def load(self, document):
+        """
+        Reads the stored batches of a document, in order.
+
+        :param document: The position of the document in the build
+        :return: A list of (chunks, embeddings) tuples
+        """
+        batches = []
+        while os.path.exists(self._path(document, len(batches))):
+            with np.load(self._path(document, len(batches))) as data:
+                chunks = [Chunk(**chunk) for chunk in json.loads(str(data["chunks"]))]
+                batches.append((chunks, data["embeddings"]))
+        return batches
+
+    def complete(self, document):
+        """
+        Marks all batches of a document as stored.
+
+        :param document: The position of the document in the build
+        """
+        open(os.path.join(self.directory, f"{document}.done"), 'w').close()
+
+    def is_complete(self, document):
+        return os.path.exists(os.path.join(self.directory, f"{document}.done"))
+
+
+class BuildJob:
+    """
+    A class for the background build of an index from uploaded PDF files.
+
+    The build runs in a daemon thread. progress() can be polled from any thread, e.g. by the
+    Streamlit app on every rerun, and the finished indexer is available as ``indexer``.
+    """
+
+    def __init__(self, directory, embedding_cache=None, result_cache=None, model=None):
+        """
+        Initialize BuildJob class from the job.json of a job directory, see JobManager.submit.
+
+        :param directory: The directory of the job
+        :param embedding_cache: Optional EmbeddingCache used by the built indexer
+        :param result_cache: Optional ResultCache used by the built indexer
+        :param model: Optional sentence encoder (default: the process-wide encoder)
+        """
+        self.directory = directory
+        with open(os.path.join(directory, "job.json"), 'r') as infile:
+            self.settings = json.load(infile)
+        self.id = self.settings["id"]
+        self.index_name = self.settings["index_name"]
+        self.state = self.settings["state"]
+        self.error = self.settings.get("error")
+        self.embedding_cache = embedding_cache
+        self.result_cache = result_cache
+        self.model = model
+        self.indexer = None
+        self.checkpoint = BatchCheckpoint(os.path.join(directory, "batches"))
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._settings_lock = threading.Lock()  # Held while job.json is written, by the build or heartbeat thread
+        self._thread = None
+        self._progress = {}
+
+    @property
+    def files(self):
+        return [LocalFile(os.path.join(self.directory, "files", str(position), name))
+                for position, name in enumerate(self.settings["files"])]
+
+    def _set_state(self, state, error=None):
+        with self._settings_lock:
+            self.state = state
+            self.error = error
+            self.settings.update(state=state, error=error, owner=OWNER, heartbeat=time.time())
+            _write_json(os.path.join(self.directory, "job.json"), self.settings)
+
+    def _beat(self):
+        """
+        Records a heartbeat every HEARTBEAT_S seconds until the build thread ends, so other processes can
+        tell the build is running rather than interrupted.
+        """
+        while self._thread.is_alive():
+            with self._settings_lock:
+                if self.state not in ("queued", "running"):
+                    return
+                self.settings["heartbeat"] = time.time()
+                _write_json(os.path.join(self.directory, "job.json"), self.settings)
+            self._thread.join(HEARTBEAT_S)
+
+    def is_stale(self, timeout):
+        """
+        Returns whether a queued or running job stopped recording heartbeats, i.e. the process running it ended.
+
+        :param timeout: The number of seconds without heartbeat after which the job is stale
+        :return: Whether the job is stale
+        """
+        return time.time() - self.settings.get("heartbeat", self.settings["created"]) > timeout
+
+    def start(self):
+        """
+        Starts or resumes the build in a background thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._cancel.clear()
+        self._set_state("queued")
+        self._thread = threading.Thread(target=self._run, name=f"build-{self.id}", daemon=True)
+        self._thread.start()
+        threading.Thread(target=self._beat, name=f"heartbeat-{self.id}", daemon=True).start()
+
+    def cancel(self):
+        """
+        Stops the build after the batch being encoded; it can be resumed later with start.
+        """
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the build thread to end.
+
+        :param timeout: Optional number of seconds to wait at most
+        :return: Whether the build thread has ended
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self._thread is None or not self._thread.is_alive()
+
+    def progress(self):
+        """
+        Returns the progress of the build. The ETA extrapolates the page rate of the current run.
+
+        :return: A dictionary with the "state", "error", "documents_total", "documents_done",
+                 "current_document", "pages_total", "pages_done", "paragraphs_embedded", "elapsed_s"
+                 and "eta_s" (None until it can be estimated) keys
+        """
+        with self._lock:
+            progress = dict(self._progress)
+        progress.update(state=self.state, error=self.error)
+        if self.state == "running" and "started" in progress:
+            progress["elapsed_s"] = time.time() - progress.pop("started")
+            pages_this_run = progress["pages_done"] - progress.pop("pages_resumed")
+            remaining = progress["pages_total"] - progress["pages_done"]
+            progress["eta_s"] = progress["elapsed_s"] * remaining / pages_this_run if pages_this_run > 0 else None
+        else:
+            progress.pop("started", None)
+            progress.pop("pages_resumed", None)
+        return progress
+
+    def _update(self, **values):
+        with self._lock:
+            self._progress.update(values)
+
+    def _run(self):
+        try:
+            self._set_state("running")
+            indexer = self._build()
+            indexer.save_index(self.index_name)
+            self.indexer = indexer  # Swapped in by whoever polls the job
+            self._set_state("done")
+            shutil.rmtree(os.path.join(self.directory, "files"), ignore_errors=True)
+            shutil.rmtree(self.checkpoint.directory, ignore_errors=True)
+        except JobCancelled:
+            self._set_state("cancelled")
+        except Exception as e:
+            self._set_state("failed", f"{type(e).__name__}: {e}")
+
+    def _build(self):
+        """
+        Parses, embeds and indexes the files, replaying the checkpointed batches of an earlier run.
+
+        :return: The built FaissIndexer
+        """
+        model = self.model or get_encoder()
+        indexer = FaissIndexer(index_config=IndexConfig.from_dict(self.settings["index_config"]),
+                               embedding_cache=self.embedding_cache, model=model, result_cache=self.result_cache,
+                               chunker=Chunker.for_encoder(model, self.settings["chunking"]))
+        pipeline = IngestPipeline(indexer, batch_size=self.settings["batch_size"],
+                                  max_workers=self.settings["max_workers"])
+        files = self.files
+        page_counts = []
+        for uploaded_file in files:
+            with fitz.open(uploaded_file.path) as pdf_document:
+                page_counts.append(pdf_document.page_count)
+        self._update(documents_total=len(files), documents_done=0, current_document=None,
+                     pages_total=sum(page_counts), pages_done=0, paragraphs_embedded=0,
+                     started=time.time(), pages_resumed=0)
+
+        executor = ProcessPoolExecutor(max_workers=pipeline.max_workers) if pipeline.max_workers != 1 else None
+        try:
+            pages_done = 0
+            for position, uploaded_file in enumerate(files):
+                if self._cancel.is_set():
+                    raise JobCancelled()
+                document_name = indexer.document_name(uploaded_file)
+                embedded = self.checkpoint.load(position)
+                embedded_count = sum(len(chunks) for chunks, _ in embedded)
+                resumed_pages = page_counts[position] if self.checkpoint.is_complete(position) else \
+                    max([chunk.page or 0 for chunks, _ in embedded for chunk in chunks], default=0)
+                with self._lock:
+                    self._progress.update(current_document=document_name, pages_done=pages_done + resumed_pages)
+                    self._progress["pages_resumed"] += resumed_pages
+                    self._progress["paragraphs_embedded"] += embedded_count
+                if self.checkpoint.is_complete(position):
+                    chunks = ()
+                else:  # The chunker is deterministic, so the chunks embedded before are skipped
+                    chunks = islice(pipeline.iter_chunks(PdfParser(uploaded_file), document_name, executor),
+                                    embedded_count, None)
+                on_batch = self._checkpointer(position, len(embedded), pages_done)
+                indexer.add_stream(document_name, chunks, batch_size=pipeline.batch_size, flush=False,
+                                   embedded_batches=embedded, on_batch=on_batch)
+                self.checkpoint.complete(position)
+                pages_done += page_counts[position]
+                with self._lock:
+                    self._progress.update(documents_done=position + 1, pages_done=pages_done)
+            indexer.flush_stream()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return indexer
+
+    def _checkpointer(self, document, first_batch, pages_before):
+        """
+        Returns the on_batch function of a document, which stores every embedded batch, updates the
+        progress and stops the build if the job was cancelled.
+        """
+        numbers = count(first_batch)
+
+        def on_batch(chunks, embeddings):
+            self.checkpoint.save(document, next(numbers), chunks, embeddings)
+            with self._lock:
+                self._progress["paragraphs_embedded"] += len(chunks)
+                self._progress["pages_done"] = pages_before + (chunks[-1].page or 0)
+            if self._cancel.is_set():
+                raise JobCancelled()
+        return on_batch
+
+
+class JobManager:
+    """
+    A class to submit, track and resume background index builds, keeping their state under a directory.
+    """
+
+    def __init__(self, directory="jobs", embedding_cache=None, result_cache=None, model=None, stale_after=30):
+        """
+        Initialize JobManager class and find the jobs left by earlier processes.
+
+        :param directory: The directory of the job directories (default: "jobs")
+        :param embedding_cache: Optional EmbeddingCache used by the built indexers
+        :param result_cache: Optional ResultCache used by the built indexers
+        :param model: Optional sentence encoder (default: the process-wide encoder)
+        :param stale_after: The number of seconds without heartbeat after which a queued or running job of
+                            another process counts as interrupted (default: 30)
+        """
+        self.directory = directory
+        self.embedding_cache = embedding_cache
+        self.result_cache = result_cache
+        self.model = model
+        self.stale_after = stale_after
+        self._jobs = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        for job_id in sorted(os.listdir(directory)):
+            if os.path.exists(os.path.join(directory, job_id, "job.json")):
+                job = self._open(os.path.join(directory, job_id))
+                self._jobs[job.id] = job
+        self._fail_stale()
+
+    def _fail_stale(self):
+        """
+        Marks the queued or running jobs of other processes as failed once their heartbeats stop, i.e. their
+        process ended, so they can be resumed. Jobs still running in another process are left alone.
+        """
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.state in ("queued", "running") and job._thread is None]
+        for job in jobs:
+            try:
+                with open(os.path.join(job.directory, "job.json"), 'r') as infile:
+                    job.settings = json.load(infile)
+            except FileNotFoundError:  # Removed by its process once done
+                continue
+            job.state, job.error = job.settings["state"], job.settings.get("error")
+            if job.state in ("queued", "running") and job.is_stale(self.stale_after):
+                job._set_state("failed", "Interrupted")
+
+    def _open(self, job_directory):
+        return BuildJob(job_directory, embedding_cache=self.embedding_cache, result_cache=self.result_cache,
+                        model=self.model)
+
+    def submit(self, uploaded_files, index_name, index_config=None, chunking="sections", max_workers=1,
+               batch_size=256):
+        """
+        Copies the uploaded files to a new job directory and starts building an index from them.
+
+        :param uploaded_files: List of uploaded PDF file objects
+        :param index_name: The name the index is saved under once built
+        :param index_config: IndexConfig of the index (default: exact flat index)
+        :param chunking: The chunking strategy (default: "sections")
+        :param max_workers: The number of processes parsing the files (default: 1)
+        :param batch_size: The number of paragraphs encoded, indexed and checkpointed at once (default: 256)
+        :return: The started BuildJob
+        """
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        job_directory = os.path.join(self.directory, job_id)
+        for position, uploaded_file in enumerate(uploaded_files):
+            os.makedirs(os.path.join(job_directory, "files", str(position)))
+            with open(os.path.join(job_directory, "files", str(position), uploaded_file.name), 'wb') as outfile:
+                outfile.write(uploaded_file.getvalue())
+        _write_json(os.path.join(job_directory, "job.json"), {
+            "id": job_id,
+            "index_name": index_name,
+            "index_config": (index_config or IndexConfig()).to_dict(),
+            "chunking": chunking,
+            "max_workers": max_workers,
+            "batch_size": batch_size,
+            "files": [uploaded_file.name for uploaded_file in uploaded_files],
+            "state": "queued",
+            "created": time.time(),
+        })
+        job = self._open(job_directory)
+        with self._lock:
+            self._jobs[job_id] = job
+        job.start()
+        return job
+
+    def get(self, job_id):
+        """
+        Returns a job by its ID.
+
+        :param job_id: The ID of the job
+        :return: The BuildJob, or None if there is none with that ID
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """
+        Returns all jobs, the most recent first.
+
+        :return: A list of BuildJob objects
+        """
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.settings["created"], reverse=True)
+
+    def resumable(self):
+        """
+        Returns the jobs that failed, were cancelled or were interrupted, and can be resumed with start.
+
+        :return: A list of BuildJob objects
+        """
+        self._fail_stale()
+        return [job for job in self.jobs() if job.state in ("failed", "cancelled")]
+
+    def remove(self, job_id):
+        """
+        Deletes a job that is not running, with its files and checkpoints.
+
+        :param job_id: The ID of the job
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in ("queued", "running"):
+                return
+            del self._jobs[job_id]
+        shutil.rmtree(job.directory, ignore_errors=True)
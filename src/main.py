@@ -1,13 +1,77 @@
 import streamlit as st
-from pathlib import Path
-from src.parse_document import PdfParser
-from src.indexer import FaissIndexer
+from src.indexer import FaissIndexer, SEARCH_MODES
+from src.encoder import get_encoder
+from src.embedding_cache import EmbeddingCache
+from src.ann_index import IndexConfig, INDEX_TYPES, COMPRESSIONS, REDUCTIONS, RERANKERS
+from src.chunking import STRATEGIES
+from src.index_store import IndexLoadError, list_indexes
+from src.result_cache import ResultCache
+from src.jobs import JobManager
 import os
 
 # Set the title and the instructions for the Streamlit app
 st.title("Vector Document Search")
-st.write("Upload one or more PDF files and click the button to parse them and dump the extracted data as JSON. "
-         "You can also build a FAISS index with the parsed JSON files and perform searches.")
+st.write("Upload one or more PDF files and click the button to parse them and build a FAISS index from their paragraphs. "
+         "You can then load an existing index and perform searches.")
+
+@st.cache_resource
+def get_embedding_cache():
+    """
+    Get the embedding cache shared by all sessions of the app.
+
+    Returns:
+        EmbeddingCache: The cache of paragraph and query embeddings.
+    """
+    return EmbeddingCache.for_encoder(get_encoder())
+
+@st.cache_resource
+def get_result_cache():
+    """
+    Get the search result cache of this app process, backed by a SQLite file shared with the other processes.
+
+    Returns:
+        ResultCache: The cache of search results.
+    """
+    return ResultCache(path="result_cache.sqlite")
+
+@st.cache_resource
+def get_job_manager():
+    """
+    Get the manager of the background index builds of this app process.
+
+    Returns:
+        JobManager: The manager of the build jobs, which resumes the jobs of earlier processes on request.
+    """
+    return JobManager(embedding_cache=get_embedding_cache(), result_cache=get_result_cache())
+
+@st.fragment(run_every=1)
+def show_build_progress():
+    """
+    Show the progress of the current background build, refreshed every second without rerunning the app.
+    Once the build is done, its index replaces the one being searched.
+    """
+    job = get_job_manager().get(st.session_state.get("build_job"))
+    if job is None:
+        return
+    progress = job.progress()
+    if job.state in ("queued", "running"):
+        fraction = progress["pages_done"] / progress["pages_total"] if progress.get("pages_total") else 0.0
+        eta = f", about {progress['eta_s']:.0f} s left" if progress.get("eta_s") is not None else ""
+        st.progress(min(fraction, 1.0), text=f"Building {job.index_name}: {progress.get('documents_done', 0)}/"
+                                             f"{progress.get('documents_total', '?')} documents, "
+                                             f"{progress.get('paragraphs_embedded', 0)} paragraphs embedded{eta}")
+        if st.button("Cancel build"):
+            job.cancel()
+    elif job.state == "done" and job.indexer is not None:
+        if st.session_state.get("swapped_job") != job.id:
+            st.session_state.indexer = job.indexer  # The previous index served searches until now
+            st.session_state.swapped_job = job.id
+            st.rerun()
+        st.success(f"Indexed {progress['paragraphs_embedded']} paragraphs from {progress['documents_total']} files. "
+                   f"Index has been built and saved as {job.index_name}.")
+    elif job.state in ("failed", "cancelled"):
+        st.error(f"Building {job.index_name} {job.state}{': ' + job.error if job.error else ''}. "
+                 f"It can be resumed from its last checkpoint.")
 
 with st.sidebar:
     # Display the build index header and create a file uploader
@@ -21,38 +85,55 @@ with st.sidebar:
     # Provide a text input for the index name
     index_name = st.text_input("Enter a name for the new index:")
 
-    # Build and save the index when the button is clicked
+    # Let the user pick the kind of FAISS index, "flat" being exact search
+    index_type = st.selectbox("Index type:", INDEX_TYPES)
+
+    # Optional vector compression and dimensionality reduction, to fit more paragraphs in memory
+    compression = st.selectbox("Vector compression:", COMPRESSIONS, format_func=lambda option: option or "none")
+    reduction = st.selectbox("Dimensionality reduction:", REDUCTIONS, format_func=lambda option: option or "none")
+
+    # Optional re-ranking of more candidates than shown, to recover the quality lost by approximate search
+    rerank = st.selectbox("Re-ranking:", RERANKERS, format_func=lambda option: option or "none")
+    rerank_candidates = st.number_input("Candidates re-ranked per result:", min_value=1, value=4)
+
+    # How documents are split into the paragraphs that are embedded, "sections" keeping chunks within a section
+    chunking = st.selectbox("Chunking strategy:", STRATEGIES)
+
+    # Number of processes the uploaded PDFs are parsed with
+    parser_workers = st.number_input("Parser worker processes:", min_value=1, value=os.cpu_count() or 1)
+
+    # Build and save the index in the background when the button is clicked, so the app stays responsive
     if st.button("Build and Save Index"):
         if uploaded_files:
             if index_name:
-                # Parse PDFs and write the output as JSON
-                for uploaded_file in uploaded_files:
-                    pdf_parser = PdfParser(uploaded_file)
-                    pdf_parser.parse_pdf()
-                    input_filename = Path(uploaded_file.name)
-                    output_filename = input_filename.stem + ".json"
-                    pdf_parser.write_json(output_filename)
-                    st.success(f"Extracted data from {input_filename} has been written to {output_filename}.")
-
-                # Build and save the FAISS index
-                st.session_state.indexer = FaissIndexer(uploaded_files)
-                st.session_state.indexer.build_index()
-                st.session_state.indexer.save_index(index_name)
-                st.success(f"Index has been built and saved as {index_name}.")
+                # Stream the PDFs through parsing, embedding and indexing, then save the FAISS index
+                index_config = IndexConfig(index_type, compression=compression, reduction=reduction, rerank=rerank,
+                                           rerank_candidates=int(rerank_candidates))
+                job = get_job_manager().submit(uploaded_files, index_name, index_config,
+                                               chunking=chunking, max_workers=int(parser_workers))
+                st.session_state.build_job = job.id
             else:
                 st.error("Please enter a name for the index.")
         else:
             st.error("Please upload one or more PDF files.")
 
+    # Offer to resume the builds that failed, were cancelled or were interrupted by a restart
+    for job in get_job_manager().resumable():
+        if st.button(f"Resume building {job.index_name} ({job.state})", key=f"resume-{job.id}"):
+            job.start()
+            st.session_state.build_job = job.id
+
+    show_build_progress()
+
 # Function to get existing FAISS indexes
 def get_existing_indexes():
     """
-    Get a list of existing FAISS indexes.
+    Get a list of existing FAISS indexes, read from their manifests.
     
     Returns:
-        list: A list of filenames of existing FAISS indexes, excluding the file extension.
+        list: A list of the names of the existing FAISS indexes.
     """
-    return [filename[:-6] for filename in os.listdir() if filename.endswith(".index")]
+    return [index["name"] for index in list_indexes() if index.get("kind", "faiss") == "faiss"]
 
 # Retrieve existing indexes and display them in a dropdown menu
 existing_indexes = get_existing_indexes()
@@ -60,24 +141,46 @@ selected_index = st.selectbox("Select an existing index:", existing_indexes)
 
 # Load the selected index when the button is clicked
 if st.button("Load Index"):
-    st.session_state.indexer = FaissIndexer.load_index(selected_index)
-    st.success(f"Index '{selected_index}' has been loaded.")
+    if selected_index is None:
+        st.error("There is no saved index to load, build one first.")
+    else:
+        try:
+            st.session_state.indexer = FaissIndexer.load_index(selected_index, embedding_cache=get_embedding_cache(),
+                                                               mmap=True, result_cache=get_result_cache())
+            st.success(f"Index '{selected_index}' has been loaded.")
+        except IndexLoadError as e:
+            st.error(f"Index '{selected_index}' could not be loaded: {e}")
 
 # Provide a text input for the query text
 query_text = st.text_input("Enter a query text to search in the FAISS index")
 
+# Optionally restrict the search to some of the indexed documents
+indexed_documents = sorted(st.session_state.indexer.documents) if st.session_state.indexer else []
+selected_documents = st.multiselect("Only search in these documents:", indexed_documents)
+
+# Vector search finds paraphrases, lexical search exact terms such as part or section numbers, hybrid fuses both
+search_mode = st.radio("Search mode:", SEARCH_MODES, index=SEARCH_MODES.index("hybrid"), horizontal=True)
+
 # Perform the search when the button is clicked
 if st.button("Search"):
     if query_text and st.session_state.indexer:
-        D, search_results = st.session_state.indexer.search_index(query_text)
+        filters = {"document": selected_documents} if selected_documents else None
+        D, I, search_results = st.session_state.indexer.search_index(query_text, filters=filters, mode=search_mode)
         st.write("Search results:")
 
-        # Display the search results
+        # Display the search results with the document, page and section they come from
         for i, result in enumerate(search_results):
-            if len(result) > 50:
-                st.write(result)
-                if i < len(search_results) - 1:  # Add a horizontal line if it's not the last result
-                    st.markdown("---")
+            metadata = st.session_state.indexer.get_metadata(I[0][i]) or {}
+            source = [metadata.get("document"), metadata.get("page") and f"page {metadata['page']}",
+                      metadata.get("header")]
+            st.caption(" · ".join(str(part) for part in source if part))
+            st.write(result)
+            if i < len(search_results) - 1:  # Add a horizontal line if it's not the last result
+                st.markdown("---")
+
+        cache_stats = get_result_cache().stats()
+        st.caption(f"Result cache: {cache_stats['hit_rate']:.0%} hit rate, "
+                   f"{cache_stats['saved_s'] * 1000:.0f} ms of search time saved")
     else:
         if not query_text:
             st.error("Please enter a query text to search.")
@@ -0,0 +1,196 @@
+import json
+import numpy as np
+
+# Columns of the store and their types; -1 marks a missing value, and a removed paragraph in "document"
+COLUMNS = {"document": "int32", "page": "int32", "section": "int32", "start": "int64", "end": "int64"}
+FILTERS = ("document", "page", "section")
+
+
+def _as_list(value):
+    return [value] if isinstance(value, (str, int)) else list(value)
+
+
+def _in_section(header, prefix):
+    """
+    Returns whether a header belongs to the section with the given number or title prefix,
+    e.g. "2.1 Scope" and "2.1.3 Limits" both belong to "2.1", but "2.10 Usage" does not.
+    """
+    return header.startswith(prefix) and (len(header) == len(prefix) or not header[len(prefix)].isdigit())
+
+
+class MetadataStore:
+    """
+    A class to store the source of every paragraph in numpy columns aligned with the vector IDs:
+    the document, the 1-based page, the section header and the byte offsets in the document text.
+
+    Document names and headers are stored once and referred to by their position, so every
+    paragraph takes 24 bytes. Filters are evaluated on whole columns at once.
+    """
+
+    def __init__(self):
+        """
+        Initialize MetadataStore class with no paragraphs.
+        """
+        self.document_names = []
+        self.section_names = []
+        self._document_codes = {}
+        self._section_codes = {}
+        self._size = 0
+        self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+    def __len__(self):
+        return self._size
+
+    def column(self, name):
+        """
+        Returns a column of the store, one value per vector ID.
+
+        :param name: One of "document", "page", "section", "start" or "end"
+        :return: A numpy array view of the column
+        """
+        return self._columns[name][:self._size]
+
+    @staticmethod
+    def _code(value, names, codes):
+        if value is None:
+            return -1
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+
+    def _reserve(self, size):
+        """
+        Makes room for size rows in every column, at least doubling them, with the new rows set to -1.
+        """
+        capacity = len(self._columns["document"])
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 1024)
+        for name, column in self._columns.items():
+            grown = np.full(capacity, -1, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+
+    def append(self, document_name, chunks):
+        """
+        Appends the metadata of the next paragraphs, which get the next vector IDs.
+
+        :param document_name: The name of the document the paragraphs belong to
+        :param chunks: List of Chunk objects
+        """
+        rows = slice(self._size, self._size + len(chunks))
+        self._reserve(rows.stop)
+        self._columns["document"][rows] = self._code(document_name, self.document_names, self._document_codes)
+        self._columns["page"][rows] = [-1 if chunk.page is None else chunk.page for chunk in chunks]
+        self._columns["section"][rows] = [self._code(chunk.header, self.section_names, self._section_codes)
+                                          for chunk in chunks]
+        self._columns["start"][rows] = [-1 if chunk.start is None else chunk.start for chunk in chunks]
+        self._columns["end"][rows] = [-1 if chunk.end is None else chunk.end for chunk in chunks]
+        self._size = rows.stop
+
+    def remove(self, ids):
+        """
+        Marks paragraphs as removed, so no filter selects them anymore.
+
+        :param ids: The vector IDs of the paragraphs
+        """
+        self._columns["document"][np.asarray(ids, dtype='int64')] = -1
+
+    def get(self, i):
+        """
+        Returns the metadata of one paragraph.
+
+        :param i: The vector ID of the paragraph
+        :return: A dictionary with "document", "page", "header", "start" and "end" keys (None when unknown),
+                 or None if the paragraph was removed
+        """
+        if not 0 <= i < self._size or self._columns["document"][i] == -1:
+            return None
+        page, section, start, end = (int(self._columns[name][i]) for name in ("page", "section", "start", "end"))
+        return {
+            "document": self.document_names[self._columns["document"][i]],
+            "page": page if page != -1 else None,
+            "header": self.section_names[section] if section != -1 else None,
+            "start": start if start != -1 else None,
+            "end": end if end != -1 else None,
+        }
+
+    def mask(self, filters):
+        """
+        Evaluates filters on all paragraphs. Every filter key takes a single value or a list of values:
+            "document": document names.
+            "page": 1-based page numbers; a range object selects a span of pages.
+            "section": section numbers or headers, matching their subsections too.
+
+        :param filters: A dictionary of filters, all of which a paragraph must match
+        :return: A boolean numpy array, True for the vector IDs of matching paragraphs
+        """
+        documents = self.column("document")
+        mask = documents != -1
+        for key, value in filters.items():
+            if key == "document":
+                codes = [self._document_codes[name] for name in _as_list(value) if name in self._document_codes]
+                mask &= np.isin(documents, codes)
+            elif key == "page":
+                pages = self.column("page")
+                if isinstance(value, range) and value.step == 1:
+                    mask &= (pages >= value.start) & (pages < value.stop)
+                else:
+                    mask &= np.isin(pages, _as_list(value))
+            elif key == "section":
+                prefixes = _as_list(value)
+                codes = [code for code, header in enumerate(self.section_names)
+                         if any(_in_section(header, prefix) for prefix in prefixes)]
+                mask &= np.isin(self.column("section"), codes)
+            else:
+                raise ValueError(f"Unknown filter '{key}', expected one of {', '.join(FILTERS)}.")
+        return mask
+
+    def save(self, filename):
+        """
+        Saves the store to a .npz file.
+
+        :param filename: The path of the file to write
+        """
+        with open(filename, 'wb') as outfile:
+            np.savez(outfile, document_names=np.array(json.dumps(self.document_names)),
+                     section_names=np.array(json.dumps(self.section_names)),
+                     **{name: self.column(name) for name in COLUMNS})
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Loads a store saved by save.
+
+        :param filename: The path of the .npz file
+        :return: An instance of MetadataStore class
+        """
+        store = cls()
+        with np.load(filename) as data:
+            store.document_names = json.loads(str(data["document_names"]))
+            store.section_names = json.loads(str(data["section_names"]))
+            store._columns = {name: data[name].astype(dtype, copy=False) for name, dtype in COLUMNS.items()}
+        store._document_codes = {name: code for code, name in enumerate(store.document_names)}
+        store._section_codes = {header: code for code, header in enumerate(store.section_names)}
+        store._size = len(store._columns["document"])
+        return store
+
+    @classmethod
+    def from_documents(cls, documents, size):
+        """
+        Rebuilds the document column from a document registry, for indexes saved without a metadata store.
+        Pages, sections and offsets are unknown.
+
+        :param documents: A dictionary mapping each document name to the vector IDs of its paragraphs
+        :param size: The number of vector IDs, including those of removed paragraphs
+        :return: An instance of MetadataStore class
+        """
+        store = cls()
+        store._reserve(size)
+        store._size = size
+        for document_name, ids in documents.items():
+            store._columns["document"][np.asarray(ids, dtype='int64')] = store._code(
+                document_name, store.document_names, store._document_codes)
+        return store
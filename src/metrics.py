@@ -0,0 +1,364 @@
+"""
+Process-wide instrumentation of the ingest and query paths: timing spans per stage, counters and
+latency histograms, exported as Prometheus text or JSON.
+
+Recording a span takes about 4 microseconds and a counter about 1.5, so instrumentation stays on by default and
+is placed around batches and page ranges, never around single paragraphs. Set VECTOR_SEARCH_METRICS=0
+to turn it off. CPU and memory profiling is opt-in, see Profiler.
+
+    with metrics.span("encode.paragraphs"):
+        embeddings = model.encode(texts)
+    metrics.count("vectors_added", len(embeddings))
+    print(metrics.to_prometheus())
+"""
+import bisect
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+# Upper bounds in seconds of the latency histogram buckets, from sub-millisecond searches to minute-long builds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(labels, extra=()):
+    pairs = [f'{name}="{value}"' for name, value in (*labels, *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """
+    A class for a histogram of observed values in fixed buckets, like a Prometheus histogram.
+    """
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket counts the values above the largest bound
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Estimates a quantile by linear interpolation within the bucket it falls in.
+
+        :param q: The quantile, between 0 and 1
+        :return: The estimated value, or None if nothing was observed
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for position, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[position - 1] if position else 0.0
+                if position == len(self.buckets):
+                    return lower  # Above the largest bound
+                return lower + (self.buckets[position] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class _Span:
+    """
+    A context manager timing one stage. Time spent in spans nested in it, e.g. parsing pages pulled
+    by the chunker, is recorded as theirs and excluded from its self time.
+    """
+
+    __slots__ = ("registry", "stage", "start", "children")
+
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self):
+        self.children = 0.0
+        self.registry._stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        stack = self.registry._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += elapsed
+        self.registry._record_span(self.stage, elapsed, elapsed - self.children)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class MetricsRegistry:
+    """
+    A class to collect counters, histograms and stage timings, safe to use from several threads.
+
+    Stage timings are kept as a "stage_seconds" histogram and a "stage_self_seconds" counter,
+    both labelled with the stage name.
+    """
+
+    def __init__(self, enabled=True, prefix="vector_search"):
+        """
+        Initialize MetricsRegistry class with no recorded values.
+
+        :param enabled: Whether values are recorded; a disabled registry ignores all calls (default: True)
+        :param prefix: The prefix of the exported metric names (default: "vector_search")
+        """
+        self.enabled = enabled
+        self.prefix = prefix
+        self.counters = {}  # Maps (name, label key) to the counter value
+        self.histograms = {}  # Maps (name, label key) to a Histogram
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def count(self, name, value=1, **labels):
+        """
+        Adds to a counter.
+
+        :param name: The name of the counter, e.g. "vectors_added"
+        :param value: The amount to add (default: 1)
+        :param labels: Optional labels distinguishing series of the counter
+        """
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Records a value in a histogram, e.g. the latency of a query in seconds.
+
+        :param name: The name of the histogram, e.g. "search_seconds"
+        :param value: The observed value
+        :param labels: Optional labels distinguishing series of the histogram
+        """
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def span(self, stage):
+        """
+        Returns a context manager timing a stage, e.g. "parse.extract", "encode.paragraphs" or "index.search".
+
+        :param stage: The name of the stage
+        :return: A context manager
+        """
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, stage)
+
+    def timed_iter(self, stage, iterable):
+        """
+        Times the production of the items of an iterable, e.g. a lazy chunk generator, as one stage.
+        The time the consumer spends between items is not included.
+
+        :param stage: The name of the stage
+        :param iterable: The iterable to time
+        :return: A generator of the items of the iterable
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        total = children = 0.0
+        try:
+            while True:
+                span = _Span(self, stage)
+                span.children = 0.0
+                stack = self._stack()
+                stack.append(span)
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed = time.perf_counter() - start
+                    stack.pop()
+                    total += elapsed
+                    children += span.children
+                yield item
+        finally:
+            if total:
+                self._record_span(stage, total, total - children)
+
+    def _record_span(self, stage, elapsed, self_elapsed):
+        stage_key = (("stage", stage),)
+        with self._lock:
+            histogram = self.histograms.get(("stage_seconds", stage_key))
+            if histogram is None:
+                histogram = self.histograms[("stage_seconds", stage_key)] = Histogram()
+            histogram.observe(elapsed)
+            key = ("stage_self_seconds", stage_key)
+            self.counters[key] = self.counters.get(key, 0.0) + self_elapsed
+
+    def reset(self):
+        """
+        Drops all recorded values.
+        """
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def to_dict(self):
+        """
+        Returns the recorded values, with the count, sum and estimated p50/p99 of every histogram.
+
+        :return: A JSON serializable dictionary with "counters" and "histograms" keys, mapping
+                 series names such as 'stage_seconds{stage="encode.paragraphs"}' to their values
+        """
+        with self._lock:
+            counters = {name + _format_labels(labels): value for (name, labels), value in self.counters.items()}
+            histograms = {name + _format_labels(labels): {
+                "count": histogram.count,
+                "sum": histogram.sum,
+                "p50": histogram.quantile(0.5),
+                "p99": histogram.quantile(0.99),
+            } for (name, labels), histogram in self.histograms.items()}
+        return {"counters": counters, "histograms": histograms}
+
+    def to_prometheus(self):
+        """
+        Returns the recorded values in the Prometheus text exposition format.
+
+        :return: The text of all metrics, counters suffixed with "_total"
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            typed = set()
+            for (name, labels), value in counters:
+                metric = f"{self.prefix}_{name}_total"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+            for (name, labels), histogram in histograms:
+                metric = f"{self.prefix}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                cumulative = 0
+                for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """
+    A class for opt-in CPU and memory profiling of a block of code, with cProfile and tracemalloc.
+    Both slow the code down noticeably, so only profile while investigating.
+
+    The profiler can be entered several times, e.g. once per search batch; cProfile only records
+    the thread that entered it, while tracemalloc traces allocations of all threads.
+
+        profiler = Profiler(memory=True)
+        with profiler:
+            indexer.search_batch(queries)
+        print(profiler.report())
+    """
+
+    def __init__(self, cpu=True, memory=False, frames=1):
+        """
+        Initialize Profiler class.
+
+        :param cpu: Whether to profile function calls with cProfile (default: True)
+        :param memory: Whether to trace memory allocations with tracemalloc (default: False)
+        :param frames: The number of stack frames tracemalloc records per allocation (default: 1)
+        """
+        self.cpu = cpu
+        self.memory = memory
+        self.frames = frames
+        self.profile = cProfile.Profile() if cpu else None
+        self.snapshot = None
+        self._tracing = False
+
+    def __enter__(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._tracing = True
+        if self.profile is not None:
+            self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.disable()
+        if self.memory and tracemalloc.is_tracing():
+            self.snapshot = tracemalloc.take_snapshot()
+        return False
+
+    def stop(self):
+        """
+        Stops tracing memory allocations, if this profiler started it.
+        """
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def report(self, limit=20):
+        """
+        Returns the functions taking the most cumulative time and the lines allocating the most memory.
+
+        :param limit: The number of functions and lines listed (default: 20)
+        :return: The report text
+        """
+        output = io.StringIO()
+        if self.profile is not None:
+            pstats.Stats(self.profile, stream=output).sort_stats("cumulative").print_stats(limit)
+        if self.snapshot is not None:
+            output.write(f"Top {limit} allocations:\n")
+            for statistic in self.snapshot.statistics("lineno")[:limit]:
+                output.write(f"{statistic}\n")
+        return output.getvalue()
+
+    def dump(self, path):
+        """
+        Writes the cProfile statistics to a file, for pstats, snakeviz or similar viewers.
+
+        :param path: The path of the file to write
+        """
+        self.profile.dump_stats(path)
+
+
+metrics = MetricsRegistry(enabled=os.environ.get("VECTOR_SEARCH_METRICS", "1") not in ("", "0", "false"))
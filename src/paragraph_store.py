@@ -0,0 +1,86 @@
+import mmap
+import struct
+import numpy as np
+
+MAGIC = b"VSPS"
+VERSION = 1
+# Magic bytes, format version and number of paragraphs
+HEADER = struct.Struct("<4sIQ")
+
+
+class ParagraphStore:
+    """
+    A class to read paragraphs from a compact, offset-indexed binary file through a memory map.
+
+    The file holds a header, the byte offset of every paragraph (plus the end offset), one byte per
+    paragraph telling whether it is present or removed, and the UTF-8 encoded paragraph texts.
+    Nothing is decoded when the file is opened: a paragraph is decoded only when it is accessed,
+    and processes opening the same file share its pages through the OS cache.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize ParagraphStore class by memory-mapping a file written by ParagraphStore.write.
+
+        :param path: The path of the paragraph store file
+        """
+        self.path = path
+        with open(path, 'rb') as infile:
+            self._mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} paragraph store.")
+        self._count = count
+        self._offsets = np.frombuffer(self._mmap, dtype='<u8', count=count + 1, offset=HEADER.size)
+        self._present = np.frombuffer(self._mmap, dtype='u1', count=count, offset=HEADER.size + 8 * (count + 1))
+        self._data_start = HEADER.size + 9 * count + 8
+
+    @staticmethod
+    def write(path, paragraphs):
+        """
+        Writes paragraphs to a paragraph store file.
+
+        :param path: The path of the file to write
+        :param paragraphs: List of paragraph texts, None for removed paragraphs
+        """
+        encoded = [b"" if paragraph is None else paragraph.encode("utf-8") for paragraph in paragraphs]
+        offsets = np.zeros(len(encoded) + 1, dtype='<u8')
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        present = np.array([paragraph is not None for paragraph in paragraphs], dtype='u1')
+        with open(path, 'wb') as outfile:
+            outfile.write(HEADER.pack(MAGIC, VERSION, len(encoded)))
+            outfile.write(offsets.tobytes())
+            outfile.write(present.tobytes())
+            for data in encoded:
+                outfile.write(data)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        """
+        Decodes a single paragraph.
+
+        :param i: The vector ID of the paragraph
+        :return: The paragraph text, or None if the paragraph was removed
+        """
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("paragraph index out of range")
+        if not self._present[i]:
+            return None
+        start = self._data_start + int(self._offsets[i])
+        end = self._data_start + int(self._offsets[i + 1])
+        return self._mmap[start:end].decode("utf-8")
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def close(self):
+        """
+        Releases the memory map of the file.
+        """
+        self._offsets = self._present = None
+        self._mmap.close()
@@ -1,6 +1,90 @@
 import re
+import os
 import json
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import fitz
+from src.metrics import metrics
+
+
+def _parse_page_range(pdf_source, start=0, stop=None):
+    """
+    Extract headers and paragraphs from a range of pages of a PDF file.
+
+    Every text block of a page is one paragraph, with its whitespace collapsed.
+    Blocks starting with a section number such as "2.1" or "2.1.3" are headers.
+
+    Parameters
+    ----------
+    pdf_source : str or bytes
+        The path of the PDF file, or its contents.
+    start : int, optional
+        The index of the first page to parse.
+    stop : int, optional
+        The index after the last page to parse, defaults to the end of the document.
+
+    Returns
+    -------
+    list
+        The (page number, is header, text) tuples of the blocks found in the pages, in reading order.
+    int
+        The number of pages parsed.
+    """
+    if isinstance(pdf_source, bytes):
+        pdf_document = fitz.open(stream=pdf_source, filetype="pdf")
+    else:
+        pdf_document = fitz.open(pdf_source)
+    blocks = []
+    if stop is None or stop > pdf_document.page_count:
+        stop = pdf_document.page_count
+    for page_num in range(start, stop):
+        page = pdf_document[page_num]
+        for block in page.get_text("blocks", sort=True):
+            if block[6] != 0:  # Image block
+                continue
+            paragraph = " ".join(block[4].split())
+            if not paragraph:
+                continue
+            blocks.append((page_num + 1, re.match(r'^\d+\.\d+', paragraph) is not None, paragraph))
+    pdf_document.close()
+    return blocks, max(0, stop - start)
+
+class LocalFile:
+    """
+    A class exposing a file on disk like a Streamlit upload, e.g. to parse or index it.
+
+    Attributes
+    ----------
+    name : str
+        The name of the file, without its directory.
+    path : str
+        The path of the file.
+    """
+
+    def __init__(self, path):
+        """
+        Initializes the LocalFile object with the path of the file.
+
+        Parameters
+        ----------
+        path : str
+            The path of the file.
+        """
+        self.name = os.path.basename(path)
+        self.path = path
+
+    def getvalue(self):
+        """
+        Read the contents of the file.
+
+        Returns
+        -------
+        bytes
+            The contents of the file.
+        """
+        with open(self.path, 'rb') as infile:
+            return infile.read()
 
 class PdfParser:
     """
@@ -15,12 +99,20 @@ class PdfParser:
     document_content : list
         A list to store the content of the document.
     page_content : list
-        A list to store the content of the pages.
+        A list to store the headers of the pages, with their page numbers.
+    blocks : list
+        A list to store the paragraphs of the document with their page number and section header.
 
     Methods
     -------
     parse_pdf():
         Parse the PDF file and extract its content.
+    parse_pdfs(uploaded_files, max_workers=None, pages_per_task=32):
+        Parse several PDF files in parallel across a process pool.
+    iter_blocks(executor=None, pages_per_task=32, prefetch=8):
+        Yield the paragraphs of the PDF file with their page and header without keeping them in memory.
+    iter_paragraphs(executor=None, pages_per_task=32, prefetch=8):
+        Yield the paragraph texts of the PDF file without keeping them in memory.
     write_json(output_filename: str):
         Write the extracted content to a JSON file.
     """
@@ -38,27 +130,161 @@ class PdfParser:
         self.file_contents = uploaded_file.getvalue()
         self.document_content = []
         self.page_content = []
+        self.blocks = []
+        self._header = None  # The last header found, which the following paragraphs belong to
+
+    def _add_blocks(self, blocks):
+        """
+        Append parsed blocks to the headers and paragraphs of the document.
+
+        Parameters
+        ----------
+        blocks : list
+            The (page number, is header, text) tuples of a range of pages, in reading order.
+
+        Returns
+        -------
+        list
+            The paragraph records added, as dictionaries with "text", "page" and "header" keys.
+        """
+        paragraphs = []
+        for page_num, is_header, text in blocks:
+            if is_header:
+                self.page_content.append({"header": text, "page": page_num})
+                self._header = text
+            else:
+                paragraphs.append({"text": text, "page": page_num, "header": self._header})
+        metrics.count("paragraphs_parsed", len(paragraphs))
+        return paragraphs
 
     def parse_pdf(self):
         """
         Parse the PDF file and extract its content using the PyMuPDF (fitz) library.
         Extracts headers and paragraphs and appends them to the respective lists.
         """
-        pdf_document = fitz.open(stream=self.file_contents, filetype="pdf")
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            text = page.get_text()
-            paragraphs = re.split('\n\n', text)
-            for paragraph in paragraphs:
-                paragraph = paragraph.strip()
-                if not paragraph:
-                    continue
-                if re.match('^\d+\.\d+\.\d+', paragraph):
-                    self.page_content.append({"header": paragraph})
-                elif re.match('^\d+\.\d+', paragraph):
-                    self.page_content.append({"header": paragraph})
-                else:
-                    self.document_content.append(paragraph)
+        with metrics.span("parse.extract"):
+            blocks, page_count = _parse_page_range(self.file_contents)
+        metrics.count("pdf_bytes_parsed", len(self.file_contents))
+        metrics.count("pages_parsed", page_count)
+        paragraphs = self._add_blocks(blocks)
+        self.blocks.extend(paragraphs)
+        self.document_content.extend(paragraph["text"] for paragraph in paragraphs)
+
+    @classmethod
+    def parse_pdfs(cls, uploaded_files, max_workers=None, pages_per_task=32):
+        """
+        Parse several PDF files in parallel across a process pool.
+
+        Every file is split into ranges of pages, and all ranges of all files are parsed
+        by the worker processes. The results are reassembled in file and page order.
+
+        Parameters
+        ----------
+        uploaded_files : list
+            The uploaded file objects containing the name and content.
+        max_workers : int, optional
+            The number of worker processes, defaults to the number of CPUs.
+            With a single worker the files are parsed in the current process.
+        pages_per_task : int, optional
+            The number of pages parsed by a worker at once.
+
+        Returns
+        -------
+        list
+            One parsed PdfParser object per uploaded file, in the same order.
+        """
+        parsers = [cls(uploaded_file) for uploaded_file in uploaded_files]
+        if max_workers == 1:
+            for parser in parsers:
+                parser.parse_pdf()
+            return parsers
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Workers read the pages they need from a file instead of receiving the whole document
+            tasks = []
+            for position, parser in enumerate(parsers):
+                pdf_path = os.path.join(tmp_dir, f"{position}.pdf")
+                with open(pdf_path, 'wb') as outfile:
+                    outfile.write(parser.file_contents)
+                with fitz.open(pdf_path) as pdf_document:
+                    page_count = pdf_document.page_count
+                metrics.count("pdf_bytes_parsed", len(parser.file_contents))
+                metrics.count("pages_parsed", page_count)
+                for start in range(0, page_count, pages_per_task):
+                    tasks.append((parser, pdf_path, start, start + pages_per_task))
+
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(_parse_page_range, pdf_path, start, stop)
+                           for _, pdf_path, start, stop in tasks]
+                for (parser, _, _, _), future in zip(tasks, futures):
+                    with metrics.span("parse.wait"):  # Time spent waiting for the worker processes
+                        blocks, _ = future.result()
+                    paragraphs = parser._add_blocks(blocks)
+                    parser.blocks.extend(paragraphs)
+                    parser.document_content.extend(paragraph["text"] for paragraph in paragraphs)
+        return parsers
+
+    def iter_blocks(self, executor=None, pages_per_task=32, prefetch=8):
+        """
+        Yield the paragraphs of the PDF file in page order, one range of pages at a time.
+        Paragraphs are not added to document_content or blocks, headers are still added to page_content.
+
+        Parameters
+        ----------
+        executor : concurrent.futures.Executor, optional
+            A process pool to parse the page ranges in, ahead of the consumer.
+            Without one the pages are parsed in the current process.
+        pages_per_task : int, optional
+            The number of pages parsed at once.
+        prefetch : int, optional
+            The maximum number of page ranges parsed ahead by the executor.
+
+        Yields
+        ------
+        dict
+            The next paragraph of the document, with "text", "page" and "header" keys.
+        """
+        with fitz.open(stream=self.file_contents, filetype="pdf") as pdf_document:
+            page_count = pdf_document.page_count
+        metrics.count("pdf_bytes_parsed", len(self.file_contents))
+        metrics.count("pages_parsed", page_count)
+        starts = range(0, page_count, pages_per_task)
+        if executor is None:
+            for start in starts:
+                with metrics.span("parse.extract"):
+                    blocks, _ = _parse_page_range(self.file_contents, start, start + pages_per_task)
+                yield from self._add_blocks(blocks)
+            return
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_path = os.path.join(tmp_dir, "document.pdf")
+            with open(pdf_path, 'wb') as outfile:
+                outfile.write(self.file_contents)
+            starts = iter(starts)
+            pending = deque()
+            for start in starts:
+                pending.append(executor.submit(_parse_page_range, pdf_path, start, start + pages_per_task))
+                if len(pending) >= prefetch:
+                    break
+            while pending:
+                with metrics.span("parse.wait"):  # Time the consumer waits for the worker processes
+                    blocks, _ = pending.popleft().result()
+                for start in starts:  # Keep the executor busy while the consumer works on this range
+                    pending.append(executor.submit(_parse_page_range, pdf_path, start, start + pages_per_task))
+                    break
+                yield from self._add_blocks(blocks)
+
+    def iter_paragraphs(self, executor=None, pages_per_task=32, prefetch=8):
+        """
+        Yield the paragraph texts of the PDF file in page order, see iter_blocks.
+
+        Yields
+        ------
+        str
+            The next paragraph of the document.
+        """
+        for block in self.iter_blocks(executor=executor, pages_per_task=pages_per_task, prefetch=prefetch):
+            yield block["text"]
 
     def write_json(self, output_filename):
         """
@@ -69,6 +295,8 @@ class PdfParser:
         output_filename : str
             The name of the output JSON file.
         """
-        data = {"document_content": " ".join(self.document_content), "page_content": self.page_content}
-        with open(output_filename, 'w') as outfile:
+        data = {"document_content": " ".join(self.document_content), "page_content": self.page_content,
+                "blocks": self.blocks}
+        with metrics.span("parse.write_json"), open(output_filename, 'w') as outfile:
             json.dump(data, outfile)
+            metrics.count("json_bytes_written", outfile.tell())
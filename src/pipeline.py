@@ -0,0 +1,60 @@
+from concurrent.futures import ProcessPoolExecutor
+from src.parse_document import PdfParser
+from src.metrics import metrics
+
+
+class IngestPipeline:
+    """
+    A class to stream uploaded PDF files into a FaissIndexer: parse, chunk, embed and index,
+    without writing intermediate JSON files and without holding a whole document's paragraphs in memory.
+    """
+
+    def __init__(self, indexer, batch_size=256, max_workers=1, pages_per_task=32):
+        """
+        Initialize IngestPipeline class.
+
+        :param indexer: The FaissIndexer to add the documents to
+        :param batch_size: The number of paragraphs encoded and added to the index at once (default: 256)
+        :param max_workers: The number of processes parsing page ranges ahead of the encoder,
+                            1 to parse in the current process, None for one per CPU (default: 1)
+        :param pages_per_task: The number of pages parsed at once (default: 32)
+        """
+        self.indexer = indexer
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.pages_per_task = pages_per_task
+
+    def iter_chunks(self, pdf_parser, document_name, executor=None):
+        """
+        Yields the chunks of a PDF file, split by the indexer's chunker as pages are parsed.
+        Chunking is timed as the "chunk" stage, excluding the parsing of the pages it pulls.
+
+        :param pdf_parser: The PdfParser of the file
+        :param document_name: The name under which the document is registered
+        :param executor: Optional process pool to parse page ranges in
+        :return: A generator of Chunk objects
+        """
+        blocks = pdf_parser.iter_blocks(executor=executor, pages_per_task=self.pages_per_task)
+        return metrics.timed_iter("chunk", self.indexer.chunker.chunk(blocks, document_name))
+
+    def run(self, uploaded_files, expected_size=None):
+        """
+        Streams the uploaded files into the indexer, one document after another.
+
+        :param uploaded_files: List of uploaded PDF file objects
+        :param expected_size: Optional estimate of the number of paragraphs, used to pick and train the index
+        :return: The number of paragraphs added
+        """
+        executor = ProcessPoolExecutor(max_workers=self.max_workers) if self.max_workers != 1 else None
+        try:
+            count = 0
+            for uploaded_file in uploaded_files:
+                pdf_parser = PdfParser(uploaded_file)
+                document_name = self.indexer.document_name(uploaded_file)
+                count += self.indexer.add_stream(document_name, self.iter_chunks(pdf_parser, document_name, executor),
+                                                 batch_size=self.batch_size, expected_size=expected_size, flush=False)
+            self.indexer.flush_stream(expected_size)
+            return count
+        finally:
+            if executor is not None:
+                executor.shutdown()
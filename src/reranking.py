@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+import numpy as np
+from src.metrics import metrics
+
+CROSS_ENCODER_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+_cross_encoders = {}  # Loaded cross-encoders shared by all indexers of the process, keyed by model name
+_lock = threading.Lock()
+
+
+def get_cross_encoder(model_name=None):
+    """
+    Returns the process-wide cross-encoder model, loading it on first use.
+    The model is read from the VECTOR_SEARCH_CROSS_ENCODER environment variable when model_name is omitted.
+
+    :param model_name: The name or path of the cross-encoder model
+    :return: A shared sentence_transformers CrossEncoder instance
+    """
+    model_name = model_name or os.environ.get("VECTOR_SEARCH_CROSS_ENCODER", CROSS_ENCODER_MODEL)
+    model = _cross_encoders.get(model_name)
+    if model is None:
+        with _lock:
+            model = _cross_encoders.get(model_name)
+            if model is None:
+                from sentence_transformers import CrossEncoder
+                model = _cross_encoders[model_name] = CrossEncoder(model_name)
+    return model
+
+
+def rerank_deadline(budget_ms, start=None):
+    """
+    Returns the time re-ranking must stop at to keep a search within its budget.
+
+    :param budget_ms: The time budget of the search in milliseconds, or None for no budget
+    :param start: The time.perf_counter() value the search started at (default: now)
+    :return: A time.perf_counter() value, or None for no budget
+    """
+    if budget_ms is None:
+        return None
+    return (time.perf_counter() if start is None else start) + budget_ms / 1000
+
+
+def top_k(results, k):
+    """
+    Keeps the first k results of every query of re-ranked results.
+
+    :param results: A (distances or scores, IDs, paragraphs) tuple as returned by search_batch
+    :param k: The number of results kept per query
+    :return: The truncated results
+    """
+    D, I, search_results = results
+    return D[:, :k], I[:, :k], [paragraphs[:k] for paragraphs in search_results]
+
+
+def _rerank_rows(results, score_row, descending, deadline):
+    """
+    Reorders the candidates of every query by new scores, until the deadline.
+
+    :param results: A (distances or scores, IDs, paragraphs) tuple as returned by search_batch
+    :param score_row: Function returning the new scores of the candidates of a row, given the row and their IDs
+    :param descending: Whether higher scores rank first
+    :param deadline: Optional time.perf_counter() value after which the remaining rows keep their order
+    :return: The reordered results, with the new scores, and the number of rows re-ranked
+    """
+    D, I, search_results = results
+    D, I, search_results = D.copy(), I.copy(), list(search_results)
+    for row in range(len(I)):
+        if deadline is not None and time.perf_counter() > deadline:
+            return (D, I, search_results), row
+        n = len(search_results[row])  # Candidates come first, padded with -1 IDs
+        if not n:
+            continue
+        ids = I[row, :n]
+        scores = np.asarray(score_row(row, ids), dtype='float32')
+        order = np.argsort(-scores if descending else scores, kind='stable')
+        D[row, :n] = scores[order]
+        I[row, :n] = ids[order]
+        search_results[row] = [search_results[row][position] for position in order]
+    return (D, I, search_results), len(I)
+
+
+def rerank_exact(query_embeddings, results, vectors, deadline=None):
+    """
+    Rescores the candidates of approximate or compressed vector search by their exact squared L2 distance
+    to the query, computed from the full-precision vectors.
+
+    :param query_embeddings: A float32 matrix with one query embedding per row
+    :param results: A (distances, IDs, paragraphs) tuple as returned by search_embeddings
+    :param vectors: The VectorStore of the index
+    :param deadline: Optional time.perf_counter() value after which the remaining queries are not rescored
+    :return: The results ordered by exact distance, and the number of queries rescored
+    """
+    def score_row(row, ids):
+        return np.square(vectors.get(ids) - query_embeddings[row]).sum(axis=1)
+    return _rerank_rows(results, score_row, False, deadline)
+
+
+def rerank_cross_encoder(queries, results, model, deadline=None):
+    """
+    Re-ranks the candidates of a search by the relevance a cross-encoder gives every query and paragraph pair.
+
+    :param queries: List of query texts
+    :param results: A (distances or scores, IDs, paragraphs) tuple as returned by search_batch
+    :param model: A CrossEncoder, see get_cross_encoder
+    :param deadline: Optional time.perf_counter() value after which the remaining queries are not re-ranked
+    :return: The results ordered by cross-encoder score, with the scores, and the number of queries re-ranked
+    """
+    def score_row(row, ids):
+        return model.predict([(queries[row], paragraph) for paragraph in results[2][row]])
+    return _rerank_rows(results, score_row, True, deadline)
+
+
+def rerank_results(index_config, queries, results, start=None):
+    """
+    Re-ranks the results of a search with the cross-encoder of an index configuration, within its time budget.
+
+    :param index_config: The IndexConfig of the searched index
+    :param queries: List of the query texts searched
+    :param results: The results of the search, as returned by search_batch
+    :param start: The time.perf_counter() value the search started at, for the budget (default: now)
+    :return: The results ordered by cross-encoder score, with the scores
+    """
+    deadline = rerank_deadline(index_config.rerank_budget_ms, start)
+    model = get_cross_encoder(index_config.rerank_model)
+    with metrics.span("rerank.cross_encoder"):
+        results, reranked = rerank_cross_encoder(queries, results, model, deadline)
+    metrics.count("queries_reranked", reranked, reranker="cross-encoder")
+    metrics.count("queries_not_reranked", len(queries) - reranked, reranker="cross-encoder")
+    return results
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_query(text):
+    """
+    Normalizes a query text for cache lookups: Unicode NFC, surrounding whitespace stripped and inner
+    whitespace collapsed. Case is kept, as the embedding model distinguishes it.
+
+    :param text: The query text
+    :return: The normalized query text
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class ResultCache:
+    """
+    A class to cache search results keyed by the normalized query, k, filters, search mode and the version
+    of the index searched, so a modified, rebuilt or reloaded index never serves stale results.
+
+    Results are kept in a bounded in-memory LRU cache whose entries expire after ttl seconds. With a path,
+    they are also stored in a SQLite database that several processes, e.g. the Streamlit app's workers,
+    share: a miss in memory is looked up there before the index is searched.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, path=None):
+        """
+        Initialize ResultCache class.
+
+        :param max_entries: The maximum number of results kept in memory, and in the database (default: 1024)
+        :param ttl: The number of seconds a result stays valid (default: 3600)
+        :param path: Optional SQLite file shared with other processes (default: in-memory cache only)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.results = OrderedDict()  # Maps keys to (expiry time, search time in seconds, result)
+        self.counters = {"hits": 0, "shared_hits": 0, "misses": 0, "saved_s": 0.0}
+        self._lock = threading.Lock()
+        self._connection = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")  # Readers do not wait for other workers' writes
+            self._connection.execute("CREATE TABLE IF NOT EXISTS results "
+                                     "(key BLOB PRIMARY KEY, expires REAL, elapsed REAL, result TEXT)")
+            self._connection.commit()
+
+    @staticmethod
+    def key(index_version, query_text, k, filters=None, mode="vector"):
+        """
+        Returns the key of a search in the cache.
+
+        :param index_version: The version of the index searched, see FaissIndexer.cache_version
+        :param query_text: The query text, normalized by normalize_query
+        :param k: The number of results
+        :param filters: Optional dictionary of filters
+        :param mode: The search mode
+        :return: The SHA-256 digest of the search parameters
+        """
+        search = [index_version, normalize_query(query_text), k, filters or {}, mode]
+        return hashlib.sha256(json.dumps(search, sort_keys=True, default=repr).encode("utf-8")).digest()
+
+    def get(self, key):
+        """
+        Returns a cached result, looking it up in memory first, then in the shared database.
+
+        :param key: The key returned by key
+        :return: A (distances, IDs, paragraphs) tuple for a single query, or None if not cached or expired
+        """
+        now = time.time()
+        with self._lock:
+            entry = self.results.get(key)
+            if entry is not None and entry[0] > now:
+                self.results.move_to_end(key)
+                self.counters["hits"] += 1
+                self.counters["saved_s"] += entry[1]
+                return entry[2]
+            if entry is not None:
+                del self.results[key]
+            entry = self._read(key, now)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self._remember(key, entry)
+            self.counters["shared_hits"] += 1
+            self.counters["saved_s"] += entry[1]
+            return entry[2]
+
+    def put(self, key, result, elapsed):
+        """
+        Stores a search result.
+
+        :param key: The key returned by key
+        :param result: A (distances, IDs, paragraphs) tuple for a single query
+        :param elapsed: The number of seconds the search took, credited as saved on every hit
+        """
+        entry = (time.time() + self.ttl, elapsed, result)
+        with self._lock:
+            self._remember(key, entry)
+            if self._connection is not None:
+                distances, ids, paragraphs = result
+                self._connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                         (key, entry[0], elapsed,
+                                          json.dumps([distances.tolist(), ids.tolist(), paragraphs])))
+                self._connection.execute("DELETE FROM results WHERE expires <= ? OR key NOT IN "
+                                         "(SELECT key FROM results ORDER BY expires DESC LIMIT ?)",
+                                         (time.time(), self.max_entries))
+                self._connection.commit()
+
+    def _remember(self, key, entry):
+        self.results[key] = entry
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+
+    def _read(self, key, now):
+        """
+        Reads a result stored in the shared database by any process.
+
+        :return: An (expiry time, search time, result) entry, or None if not stored or expired
+        """
+        if self._connection is None:
+            return None
+        row = self._connection.execute("SELECT expires, elapsed, result FROM results WHERE key = ? AND expires > ?",
+                                       (key, now)).fetchone()
+        if row is None:
+            return None
+        distances, ids, paragraphs = json.loads(row[2])
+        return row[0], row[1], (np.array(distances, dtype='float32'), np.array(ids, dtype='int64'), paragraphs)
+
+    def clear(self):
+        """
+        Drops all cached results, including those in the shared database.
+        """
+        with self._lock:
+            self.results.clear()
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM results")
+                self._connection.commit()
+
+    def stats(self):
+        """
+        Returns the hit and miss counters, the hit rate and the search time saved by hits.
+
+        :return: A dictionary of counters, with the hit rate and the number of cached results in memory
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self.results)
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["shared_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        """
+        Closes the connection to the shared database.
+        """
+        if self._connection is not None:
+            self._connection.close()
@@ -0,0 +1,401 @@
+"""
+Asynchronous HTTP search service around a saved FaissIndexer.
+
+Concurrent search requests arriving within a short window are coalesced into one batched encode and
+one FAISS search. Run from the repository root:
+
+    python -m src.server --index my_index --port 8000
+
+Endpoints:
+    POST /search   {"query": "...", "k": 5, "filters": {"document": "...", "page": [...], "section": "..."},
+                    "mode": "vector" | "lexical" | "hybrid"}
+                   ->  {"results": [{"id", "distance", "paragraph", "document", "page", "header"}, ...]}
+    GET  /metrics  request count, batch sizes, p50/p99 latency in milliseconds, result cache statistics
+                   and the stage timings and counters of the indexer
+    GET  /metrics/prometheus  the same stage timings, counters and latency histograms in Prometheus text format
+    GET  /health   {"status": "ok"}
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import numpy as np
+from src.indexer import FaissIndexer, SEARCH_MODES
+from src.metadata_store import FILTERS
+from src.index_store import IndexLoadError
+from src.result_cache import ResultCache
+from src.metrics import Profiler, metrics
+
+
+def _valid_filters(filters):
+    """
+    Returns whether the filters of a search request are well-formed: "document" and "section" take a string
+    or a list of strings, "page" an integer or a list of integers.
+    """
+    if not isinstance(filters, dict) or not set(filters) <= set(FILTERS):
+        return False
+    for key, value in filters.items():
+        values = value if isinstance(value, list) else [value]
+        if key == "page":
+            valid = all(isinstance(page, int) and not isinstance(page, bool) for page in values)
+        else:
+            valid = all(isinstance(name, str) for name in values)
+        if not valid:
+            return False
+    return True
+
+
+class LatencyTracker:
+    """
+    A class to keep the most recent request latencies and report their percentiles.
+    """
+
+    def __init__(self, window=10000):
+        """
+        Initialize LatencyTracker class.
+
+        :param window: The number of most recent latencies the percentiles are computed over (default: 10000)
+        """
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+
+    def record(self, latency_ms):
+        """
+        Records the latency of one request.
+
+        :param latency_ms: The latency in milliseconds
+        """
+        self.latencies.append(latency_ms)
+        self.requests += 1
+
+    def percentile(self, q):
+        """
+        Returns a percentile of the recorded latencies.
+
+        :param q: The percentile, between 0 and 100
+        :return: The latency in milliseconds, or None if nothing was recorded
+        """
+        if not self.latencies:
+            return None
+        return float(np.percentile(np.fromiter(self.latencies, dtype=float), q))
+
+
+class MicroBatcher:
+    """
+    A class to coalesce concurrent search requests into batched FaissIndexer searches.
+    Requests of a batch with the same filters and search mode share one search.
+
+    The first request of a batch waits at most max_wait_ms for more requests to join it. The batch
+    is searched in a single worker thread, so one model copy serves all requests without blocking the event loop.
+    """
+
+    def __init__(self, indexer, max_batch_size=64, max_wait_ms=5, profiler=None):
+        """
+        Initialize MicroBatcher class.
+
+        :param indexer: The FaissIndexer to search
+        :param max_batch_size: The maximum number of queries searched at once (default: 64)
+        :param max_wait_ms: The maximum time a request waits for others to join its batch (default: 5)
+        :param profiler: Optional Profiler that every batch search is profiled with
+        """
+        self.indexer = indexer
+        self.profiler = profiler
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.batches = 0
+        self.batched_queries = 0
+        self._queue = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def start(self):
+        """
+        Starts collecting batches; must be called from within the running event loop.
+        """
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops collecting batches and shuts the search thread down.
+        """
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown()
+
+    async def search(self, query_text, k=5, filters=None, mode="vector"):
+        """
+        Searches the index for one query as part of the next batch.
+
+        :param query_text: The query text to search for in the index
+        :param k: The number of top results to return (default: 5)
+        :param filters: Optional dictionary of filters, see FaissIndexer.search_index
+        :param mode: "vector", "lexical" or "hybrid", see FaissIndexer.search_index (default: "vector")
+        :return: A list of (ID, distance or score, paragraph) tuples
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query_text, k, filters, mode, future))
+        return await future
+
+    async def _run(self):
+        """
+        Collects requests into batches and searches them until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.batches += 1
+            self.batched_queries += len(batch)
+            try:
+                results = await loop.run_in_executor(self._executor, self._profiled_search_batch, batch)
+            except Exception as e:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (*_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _profiled_search_batch(self, batch):
+        if self.profiler is None:
+            return self._search_batch(batch)
+        with self.profiler:
+            return self._search_batch(batch)
+
+    def _search_batch(self, batch):
+        """
+        Searches a batch of requests with a single encode and search per distinct filters and mode,
+        at the largest k of the requests sharing them. A group that fails does not fail the others.
+
+        :param batch: List of (query text, k, filters, mode, future) tuples
+        :return: A list with, for every request, its (ID, distance or score, paragraph) tuples or the exception
+                 its group raised
+        """
+        groups = {}
+        for row, (_, _, filters, mode, _) in enumerate(batch):
+            groups.setdefault((json.dumps(filters, sort_keys=True), mode), []).append(row)
+        results = [None] * len(batch)
+        for rows in groups.values():
+            _, _, filters, mode, _ = batch[rows[0]]
+            max_k = max(batch[row][1] for row in rows)
+            try:
+                D, I, search_results = self.indexer.search_batch([batch[row][0] for row in rows], max_k, filters,
+                                                                 mode)
+            except Exception as e:
+                for row in rows:
+                    results[row] = e
+                continue
+            for position, row in enumerate(rows):
+                results[row] = list(zip(I[position].tolist(), D[position].tolist(),
+                                        search_results[position]))[:batch[row][1]]
+        return results
+
+
+class SearchServer:
+    """
+    A class to serve FaissIndexer searches over HTTP/1.1 with asyncio.
+    """
+
+    def __init__(self, indexer, host="127.0.0.1", port=8000, max_batch_size=64, max_wait_ms=5, max_k=100,
+                 profiler=None):
+        """
+        Initialize SearchServer class.
+
+        :param indexer: The FaissIndexer to search
+        :param host: The address to listen on (default: "127.0.0.1")
+        :param port: The port to listen on (default: 8000)
+        :param max_batch_size: The maximum number of queries searched at once (default: 64)
+        :param max_wait_ms: The maximum time a request waits for others to join its batch (default: 5)
+        :param max_k: The largest number of results a request may ask for (default: 100)
+        :param profiler: Optional Profiler that every batch search is profiled with
+        """
+        self.host = host
+        self.port = port
+        self.max_k = max_k
+        self.indexer = indexer
+        self.batcher = MicroBatcher(indexer, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                                    profiler=profiler)
+        self.latency = LatencyTracker()
+
+    async def serve(self):
+        """
+        Serves requests until the task is cancelled.
+        """
+        self.batcher.start()
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+
+    def metrics(self):
+        """
+        Returns the request and batching statistics of the service, with the stage timings and counters.
+
+        :return: A JSON serializable dictionary
+        """
+        service_metrics = {
+            "requests": self.latency.requests,
+            "batches": self.batcher.batches,
+            "mean_batch_size": self.batcher.batched_queries / self.batcher.batches if self.batcher.batches else 0.0,
+            "p50_ms": self.latency.percentile(50),
+            "p99_ms": self.latency.percentile(99),
+        }
+        if self.indexer.result_cache is not None:
+            service_metrics["result_cache"] = self.indexer.result_cache.stats()
+        service_metrics["stages"] = metrics.to_dict()
+        return service_metrics
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Handles the requests of one keep-alive connection.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, payload = await self._route(method, urlsplit(target).path, body)
+                if isinstance(payload, str):
+                    data, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+                else:
+                    data, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                             f"Content-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        """
+        Dispatches a request to its endpoint.
+
+        :return: A tuple of the HTTP status line and the JSON payload
+        """
+        if path == "/health" and method == "GET":
+            return "200 OK", {"status": "ok"}
+        if path == "/metrics" and method == "GET":
+            return "200 OK", self.metrics()
+        if path == "/metrics/prometheus" and method == "GET":
+            return "200 OK", metrics.to_prometheus()
+        if path != "/search":
+            return "404 Not Found", {"error": f"No endpoint {path}"}
+        if method != "POST":
+            return "405 Method Not Allowed", {"error": "Use POST /search"}
+        try:
+            request = json.loads(body or b"{}")
+            query_text = request["query"]
+            k = int(request.get("k", 5))
+            filters = request.get("filters") or None
+            mode = request.get("mode", "vector")
+            if not isinstance(query_text, str) or not 1 <= k <= self.max_k or mode not in SEARCH_MODES:
+                raise ValueError
+            if filters is not None and not _valid_filters(filters):
+                raise ValueError
+        except (ValueError, KeyError, TypeError):
+            return "400 Bad Request", {"error": f"Expected {{\"query\": str, \"k\": 1..{self.max_k}, "
+                                                f"\"filters\": {{{', '.join(FILTERS)}}}, "
+                                                f"\"mode\": {' | '.join(SEARCH_MODES)}}}"}
+
+        start = time.perf_counter()
+        try:
+            results = await self.batcher.search(query_text, k, filters, mode)
+        except Exception as e:  # The request is valid, so the failure is the server's
+            return "500 Internal Server Error", {"error": f"{type(e).__name__}: {e}"}
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.latency.record(latency_ms)
+        metrics.observe("request_seconds", latency_ms / 1000, mode=mode)
+        return "200 OK", {
+            "results": [self._result(i, distance, paragraph) for i, distance, paragraph in results],
+            "latency_ms": latency_ms,
+        }
+
+
+    def _result(self, i, distance, paragraph):
+        """
+        Returns one search result with the source of its paragraph.
+
+        :return: A JSON serializable dictionary
+        """
+        metadata = self.batcher.indexer.get_metadata(i) or {}
+        return {"id": i, "distance": distance, "paragraph": paragraph, "document": metadata.get("document"),
+                "page": metadata.get("page"), "header": metadata.get("header")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve searches over a saved FAISS index.")
+    parser.add_argument("--index", required=True, help="Name of the saved index")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="Largest batch of queries (default: 64)")
+    parser.add_argument("--max-wait-ms", type=float, default=5, help="Batching window in ms (default: 5)")
+    parser.add_argument("--mmap", action="store_true", help="Memory-map the index instead of reading it")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="Number of search results cached, 0 to disable the cache (default: 1024)")
+    parser.add_argument("--cache-ttl", type=float, default=3600, help="Seconds results stay cached (default: 3600)")
+    parser.add_argument("--cache-path", help="SQLite file sharing cached results with other processes")
+    parser.add_argument("--profile", help="Profile the searches with cProfile and write the statistics to this file "
+                                          "on exit (slows searches down)")
+    parser.add_argument("--profile-memory", action="store_true", help="Also trace memory allocations with tracemalloc")
+    args = parser.parse_args()
+
+    result_cache = None
+    if args.cache_size > 0:
+        result_cache = ResultCache(max_entries=args.cache_size, ttl=args.cache_ttl, path=args.cache_path)
+    try:
+        indexer = FaissIndexer.load_index(args.index, mmap=args.mmap, result_cache=result_cache)
+    except IndexLoadError as e:
+        parser.error(f"Could not load index '{args.index}': {e}")
+    profiler = Profiler(memory=args.profile_memory) if args.profile else None
+    server = SearchServer(indexer, host=args.host, port=args.port,
+                          max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms, profiler=profiler)
+    print(f"Serving index '{args.index}' on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if profiler is not None:
+            profiler.dump(args.profile)
+            print(profiler.report())
+            profiler.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+import os
+import shutil
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from src.ann_index import IndexConfig
+from src.indexer import FaissIndexer, SEARCH_MODES
+from src.bm25 import reciprocal_rank_fusion
+from src.reranking import rerank_results, top_k
+from src.index_store import (IndexLoadError, is_index_directory, read_manifest, replace_directory,
+                             resolve_directory, temporary_directory, write_manifest)
+from src.chunking import Chunker
+from src.encoder import MODEL_NAME, get_encoder
+
+
+class ShardedFaissIndexer:
+    """
+    A class to partition paragraphs across several FaissIndexer shards and search them with scatter-gather.
+
+    Documents are assigned to shards by a stable hash of their name, so every shard can be built, saved
+    and reloaded on its own, e.g. by a separate process, as the "shard<i>" subdirectory of the index.
+    Queries are encoded once, searched on all shards in parallel threads, and the per-shard top-k are
+    merged into the global top-k by distance. With exact re-ranking, every shard rescores its own candidates,
+    so the merged distances are exact; cross-encoder re-ranking is applied to the merged results.
+    """
+
+    def __init__(self, num_shards=4, index_config=None, embedding_cache=None, model=None, chunker=None):
+        """
+        Initialize ShardedFaissIndexer class with empty shards.
+
+        :param num_shards: The number of shards (default: 4)
+        :param index_config: IndexConfig describing the kind of FAISS index built for every shard
+        :param embedding_cache: Optional EmbeddingCache shared by all shards
+        :param model: Optional sentence encoder shared by all shards (default: the process-wide encoder)
+        :param chunker: Optional Chunker shared by all shards (default: sized for the model on first use)
+        """
+        self.num_shards = num_shards
+        self.model = model or get_encoder()
+        self.model_name = getattr(self.model, "model_name", MODEL_NAME)
+        self.embedding_cache = embedding_cache
+        self.index_config = index_config or IndexConfig()
+        self._chunker = chunker
+        self.shards = [FaissIndexer(None, index_config=self.index_config, embedding_cache=embedding_cache, model=self.model,
+                                    chunker=chunker) for _ in range(num_shards)]
+        self._executor = ThreadPoolExecutor(max_workers=num_shards)
+
+    def close(self):
+        """
+        Shuts down the threads the shards are built, saved and searched with.
+        """
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def chunker(self):
+        """
+        The Chunker shared by all shards, sized for the model when created on first use.
+        """
+        if self._chunker is None:
+            self._chunker = Chunker.for_encoder(self.model)
+            for shard in self.shards:
+                shard._chunker = self._chunker
+        return self._chunker
+
+    document_name = staticmethod(FaissIndexer.document_name)
+
+    def shard_of(self, document_name):
+        """
+        Returns the shard a document belongs to.
+
+        :param document_name: The name of the document
+        :return: The shard number
+        """
+        return zlib.crc32(document_name.encode("utf-8")) % self.num_shards
+
+    def partition(self, uploaded_files):
+        """
+        Splits uploaded files by the shard their documents belong to.
+
+        :param uploaded_files: List of file objects
+        :return: A list with the file objects of every shard
+        """
+        partitions = [[] for _ in range(self.num_shards)]
+        for uploaded_file in uploaded_files:
+            partitions[self.shard_of(self.document_name(uploaded_file))].append(uploaded_file)
+        return partitions
+
+    def to_global_ids(self, shard, ids):
+        """
+        Converts vector IDs of a shard into IDs that are unique across shards.
+
+        :param shard: The shard number
+        :param ids: A numpy array of vector IDs of the shard, -1 for missing results
+        :return: A numpy array of global IDs, -1 for missing results
+        """
+        return np.where(ids == -1, -1, ids * self.num_shards + shard)
+
+    def from_global_id(self, global_id):
+        """
+        Converts a global ID back into a shard number and a vector ID of that shard.
+
+        :param global_id: A global ID
+        :return: A tuple of the shard number and the shard's vector ID
+        """
+        return global_id % self.num_shards, global_id // self.num_shards
+
+    def build_index(self, uploaded_files):
+        """
+        Builds all shards from the uploaded files, in parallel.
+
+        :param uploaded_files: List of file objects to be indexed
+        """
+        def build(shard, files):
+            shard.uploaded_files = files
+            shard.build_index()
+        list(self._executor.map(build, self.shards, self.partition(uploaded_files)))
+
+    def add_documents(self, uploaded_files):
+        """
+        Adds new documents to the shards they belong to.
+
+        :param uploaded_files: List of file objects to be added to the index
+        :return: The number of paragraphs added
+        """
+        return sum(shard.add_documents(files)
+                   for shard, files in zip(self.shards, self.partition(uploaded_files)) if files)
+
+    def add_stream(self, document_name, paragraphs, batch_size=256, expected_size=None, flush=True):
+        """
+        Adds a document from an iterable of paragraphs to the shard it belongs to, see FaissIndexer.add_stream.
+
+        :param document_name: The name under which the document is registered
+        :param paragraphs: Iterable of paragraph texts or Chunk objects, e.g. a generator
+        :param batch_size: The number of paragraphs encoded and added at once (default: 256)
+        :param expected_size: Optional estimate of the corpus size, divided evenly across shards
+        :param flush: Whether to add held back batches at the end of the document (default: True)
+        :return: The number of paragraphs added
+        """
+        shard_size = expected_size // self.num_shards if expected_size else None
+        return self.shards[self.shard_of(document_name)].add_stream(
+            document_name, paragraphs, batch_size=batch_size, expected_size=shard_size, flush=flush)
+
+    def flush_stream(self, expected_size=None):
+        """
+        Adds the streamed batches every shard held back for training.
+
+        :param expected_size: Optional estimate of the corpus size, divided evenly across shards
+        """
+        shard_size = expected_size // self.num_shards if expected_size else None
+        for shard in self.shards:
+            shard.flush_stream(shard_size)
+
+    def remove_document(self, document_name):
+        """
+        Removes a document from the shard it belongs to.
+
+        :param document_name: The name of the document
+        :return: The number of paragraphs removed
+        """
+        return self.shards[self.shard_of(document_name)].remove_document(document_name)
+
+    def replace_document(self, uploaded_file):
+        """
+        Replaces a document in the shard it belongs to.
+
+        :param uploaded_file: The file object of the document to be replaced
+        :return: The number of paragraphs added
+        """
+        return self.shards[self.shard_of(self.document_name(uploaded_file))].replace_document(uploaded_file)
+
+    def _encode_queries(self, queries):
+        """
+        Encodes query texts once for all shards, through the embedding cache if there is one.
+
+        :param queries: List of query texts to encode
+        :return: A float32 matrix with one embedding per query
+        """
+        def encode(texts):
+            return np.array(self.model.encode(texts)).astype('float32')
+        if self.embedding_cache is None:
+            return encode(queries)
+        return self.embedding_cache.encode_queries(queries, encode)
+
+    def search_index(self, query_text, k=5, filters=None, mode="vector"):
+        """
+        Searches all shards for the most similar paragraphs to the query_text.
+
+        :param query_text: The query text to search for in the index
+        :param k: The number of top results to return (default: 5)
+        :param filters: Optional dictionary of filters applied within every shard, see FaissIndexer.search_index
+        :param mode: "vector", "lexical" or "hybrid", see FaissIndexer.search_index (default: "vector")
+        :return: A tuple containing distances (scores for lexical and hybrid search), global IDs
+                 and the matching paragraphs
+        """
+        D, I, search_results = self.search_batch([query_text], k, filters, mode)
+        return D, I, search_results[0]
+
+    def search_batch(self, queries, k=5, filters=None, mode="vector"):
+        """
+        Searches all shards for several query texts at once. Hybrid search fuses the merged
+        vector and lexical rankings of all shards.
+
+        :param queries: List of query texts to search for in the index
+        :param k: The number of top results to return per query (default: 5)
+        :param filters: Optional dictionary of filters applied to all queries, see FaissIndexer.search_index
+        :param mode: "vector", "lexical" or "hybrid", see FaissIndexer.search_index (default: "vector")
+        :return: A tuple containing the distance (or score) and global ID matrices, one row per query,
+                 and a list with the matching paragraphs of each query
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}', expected one of {', '.join(SEARCH_MODES)}.")
+        queries = list(queries)
+        if not queries:
+            return np.empty((0, k), dtype='float32'), np.empty((0, k), dtype='int64'), []
+        start = time.perf_counter()
+        cross_encode = self.index_config.rerank == "cross-encoder"
+        n_results = k * self.index_config.rerank_candidates if cross_encode else k
+        if mode == "lexical":
+            results = self.search_lexical(queries, n_results, filters)
+        else:
+            candidates = max(n_results, FaissIndexer.HYBRID_CANDIDATES) if mode == "hybrid" else n_results
+            results = self.search_embeddings(self._encode_queries(queries), candidates, filters)
+            if mode == "hybrid":
+                results = reciprocal_rank_fusion([results, self.search_lexical(queries, candidates, filters)],
+                                                 n_results)
+        if not cross_encode:
+            return results
+        return top_k(rerank_results(self.index_config, queries, results, start), k)
+
+    def search_embeddings(self, query_embeddings, k=5, filters=None):
+        """
+        Searches every non-empty shard in parallel and merges their top-k into the global top-k by distance.
+
+        :param query_embeddings: A float32 matrix with one query embedding per row
+        :param k: The number of top results to return per query (default: 5)
+        :param filters: Optional dictionary of filters applied to all queries, see FaissIndexer.search_index
+        :return: A tuple containing the distance and global ID matrices, one row per query,
+                 and a list with the matching paragraphs of each query
+        """
+        shards = self._searched_shards(filters)
+        shard_results = list(self._executor.map(
+            lambda number: self.shards[number].search_embeddings(query_embeddings, k, filters), shards))
+        return self._merge(shards, shard_results, len(query_embeddings), k)
+
+    def search_lexical(self, queries, k=5, filters=None):
+        """
+        Searches the BM25 index of every non-empty shard in parallel and merges their top-k by score.
+        Every shard scores terms by its own document frequencies.
+
+        :param queries: List of query texts to search for in the index
+        :param k: The number of top results to return per query (default: 5)
+        :param filters: Optional dictionary of filters applied to all queries, see FaissIndexer.search_index
+        :return: A tuple containing the BM25 score and global ID matrices, one row per query, best first,
+                 and a list with the matching paragraphs of each query
+        """
+        shards = self._searched_shards(filters)
+        shard_results = list(self._executor.map(
+            lambda number: self.shards[number].search_lexical(queries, k, filters), shards))
+        negated = [(-scores, I, search_results) for scores, I, search_results in shard_results]
+        D, I, search_results = self._merge(shards, negated, len(queries), k)
+        return -D, I, search_results
+
+    def _searched_shards(self, filters):
+        """
+        Returns the numbers of the non-empty shards, without those a document filter rules out.
+        """
+        shards = [number for number, shard in enumerate(self.shards) if shard.index is not None]
+        if filters and "document" in filters:
+            documents = [filters["document"]] if isinstance(filters["document"], str) else filters["document"]
+            document_shards = {self.shard_of(name) for name in documents}
+            shards = [number for number in shards if number in document_shards]
+        return shards
+
+    def _merge(self, shards, shard_results, n_queries, k):
+        """
+        Merges the per-shard top-k results into the global top-k, smallest distance first.
+
+        :param shards: The shard numbers the results come from
+        :param shard_results: The (distances, IDs, paragraphs) tuple of every shard
+        :param n_queries: The number of queries
+        :param k: The number of top results to return per query
+        :return: A tuple containing the distance and global ID matrices, one row per query,
+                 and a list with the matching paragraphs of each query
+        """
+        distances = np.full((n_queries, len(shards) * k), np.inf, dtype='float32')
+        ids = np.full((n_queries, len(shards) * k), -1, dtype='int64')
+        paragraphs = np.full((n_queries, len(shards) * k), None, dtype=object)
+        for position, (number, (D, I, search_results)) in enumerate(zip(shards, shard_results)):
+            columns = slice(position * k, (position + 1) * k)
+            found = I != -1
+            distances[:, columns] = np.where(found, D, np.inf)
+            ids[:, columns] = self.to_global_ids(number, I)
+            for row, texts in enumerate(search_results):
+                paragraphs[row, position * k:position * k + len(texts)] = texts
+
+        order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+        D = np.take_along_axis(distances, order, axis=1)
+        I = np.take_along_axis(ids, order, axis=1)
+        search_results = [[text for i, text in zip(I[row], paragraphs[row, order[row]]) if i != -1]
+                          for row in range(n_queries)]
+        return D, I, search_results
+
+    def get_metadata(self, global_id):
+        """
+        Returns the source of a paragraph returned by a search.
+
+        :param global_id: The global ID of the paragraph
+        :return: A dictionary with "document", "page", "header", "start" and "end" keys, or None if removed
+        """
+        shard, i = self.from_global_id(int(global_id))
+        return self.shards[shard].get_metadata(i)
+
+    def save_index(self, index_name):
+        """
+        Saves every non-empty shard to a "shard<i>" subdirectory of the directory index_name, with a manifest
+        listing them. The directory is written under a temporary name and renamed once complete.
+
+        :param index_name: The name of the index to be saved, i.e. the path of its directory
+        """
+        directory = temporary_directory(index_name)
+        try:
+            self._save_shards(directory, range(self.num_shards))
+            self._write_manifest(directory)
+            replace_directory(directory, index_name)
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+    def save_shards(self, index_name, shards):
+        """
+        Saves some of the shards of an already saved index, in parallel, without touching the others.
+        Every shard directory is replaced atomically, then the manifest.
+
+        :param index_name: The name of the sharded index
+        :param shards: The numbers of the shards to save
+        """
+        self._save_shards(index_name, shards)
+        self._write_manifest(index_name)
+
+    def _save_shards(self, directory, shards):
+        list(self._executor.map(lambda number: self.shards[number].save_index(self.shard_name(directory, number)),
+                                [number for number in shards if self.shards[number].index is not None]))
+
+    def _write_manifest(self, directory):
+        """
+        Writes the manifest of a sharded index, listing the shards saved in its directory.
+        """
+        shard_names = [f"shard{number}" if is_index_directory(self.shard_name(directory, number)) else None
+                       for number in range(self.num_shards)]  # Empty shards are not saved
+        write_manifest(directory, {
+            "kind": "sharded",
+            "model_name": self.model_name,
+            "num_shards": self.num_shards,
+            "index_config": self.index_config.to_dict(),
+            "shards": shard_names,
+        })
+
+    @staticmethod
+    def shard_name(index_name, number):
+        """
+        Returns the name a shard is saved under.
+
+        :param index_name: The name of the sharded index
+        :param number: The shard number
+        :return: The path of the shard's index directory
+        """
+        return os.path.join(index_name, f"shard{number}")
+
+    def reload_shard(self, index_name, number, mmap=False):
+        """
+        Replaces one shard with its saved version, e.g. after it was rebuilt by another process.
+
+        :param index_name: The name of the sharded index
+        :param number: The shard number
+        :param mmap: Whether to memory-map the shard (default: False)
+        :raises IndexLoadError: If the shard cannot be loaded; the current shard is kept then
+        """
+        shard = FaissIndexer.load_index(self.shard_name(index_name, number), embedding_cache=self.embedding_cache,
+                                        mmap=mmap, model=self.model)
+        shard._chunker = self._chunker
+        self.shards[number] = shard
+
+    @classmethod
+    def load_index(cls, index_name, embedding_cache=None, mmap=False, model=None, shards=None):
+        """
+        Loads a sharded index from its manifest and shard directories, loading the shards in parallel.
+
+        :param index_name: The name of the index to be loaded, i.e. the path of its directory
+        :param embedding_cache: Optional EmbeddingCache shared by all shards
+        :param mmap: Whether to memory-map the shards (default: False)
+        :param model: Optional sentence encoder shared by all shards (default: the process-wide encoder)
+        :param shards: Optional list of shard numbers to load; the other shards stay empty
+        :return: An instance of ShardedFaissIndexer class with the loaded shards
+        :raises IndexLoadError: If the manifest or one of the loaded shards is missing or incomplete
+        """
+        index_name = resolve_directory(index_name)  # Load all shards from one version
+        manifest = read_manifest(index_name)
+        if manifest.get("kind") != "sharded":
+            raise IndexLoadError(f"'{index_name}' is a {manifest.get('kind')} index, not a sharded index.")
+        indexer = cls(manifest["num_shards"], index_config=IndexConfig.from_dict(manifest["index_config"]),
+                      embedding_cache=embedding_cache, model=model)
+        numbers = [number for number in (range(indexer.num_shards) if shards is None else shards)
+                   if manifest["shards"][number] is not None]
+        try:
+            list(indexer._executor.map(lambda number: indexer.reload_shard(index_name, number, mmap=mmap), numbers))
+        except BaseException:
+            indexer.close()
+            raise
+        return indexer
@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class VectorStore:
+    """
+    A class to keep the full-precision embeddings of the paragraphs by vector ID, next to a compressed or
+    approximate FAISS index, to rescore its candidates exactly.
+
+    The store is saved as a .npy file and memory-mapped when loaded, so only the rows of the candidates
+    being rescored are read from disk. It is copied into memory when vectors are appended.
+    """
+
+    def __init__(self):
+        """
+        Initialize VectorStore class with no vectors.
+        """
+        self._vectors = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, size, dimension):
+        """
+        Makes room for size vectors of the given dimension, at least doubling the capacity, and copies a
+        memory-mapped store into memory, since the mapped file is read-only.
+        """
+        capacity = 0 if self._vectors is None else len(self._vectors)
+        if size <= capacity and isinstance(self._vectors, np.ndarray) and self._vectors.flags.writeable:
+            return
+        grown = np.empty((max(size, 2 * capacity, 1024), dimension), dtype='float32')
+        if self._size:
+            grown[:self._size] = self._vectors[:self._size]
+        self._vectors = grown
+
+    def append(self, embeddings):
+        """
+        Appends the embeddings of the next paragraphs, which get the next vector IDs.
+
+        :param embeddings: A float32 matrix with one embedding per paragraph
+        """
+        rows = slice(self._size, self._size + len(embeddings))
+        self._reserve(rows.stop, embeddings.shape[1])
+        self._vectors[rows] = embeddings
+        self._size = rows.stop
+
+    def get(self, ids):
+        """
+        Returns the vectors of some paragraphs.
+
+        :param ids: Array of vector IDs
+        :return: A float32 matrix with one vector per ID
+        """
+        return np.asarray(self._vectors[np.asarray(ids, dtype='int64')], dtype='float32')
+
+    def save(self, filename):
+        """
+        Saves the store to a .npy file.
+
+        :param filename: The path of the file to write
+        """
+        with open(filename, 'wb') as outfile:
+            np.save(outfile, self._vectors[:self._size] if self._size else np.empty((0, 0), dtype='float32'))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Memory-maps a store saved by save.
+
+        :param filename: The path of the .npy file
+        :return: An instance of VectorStore class
+        """
+        store = cls()
+        store._vectors = np.load(filename, mmap_mode='r')
+        store._size = len(store._vectors)
+        return store